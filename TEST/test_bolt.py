@@ -0,0 +1,104 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'node_configure'))
+import args_parser
+import util
+
+VERSION_OUTPUT = '''LLVM (http://llvm.org/):
+  LLVM version %s
+  Optimized build.
+BOLT revision 0123456789abcdef
+'''
+
+
+class ConfigureBoltTest(unittest.TestCase):
+    """configure_bolt with stub llvm-bolt, perf2bolt, merge-fdata and perf
+    scripts on PATH."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.bin_dir = os.path.join(self.tmp, 'bin')
+        os.makedirs(self.bin_dir)
+        self.saved = (os.getcwd(), os.environ.get('PATH'), util.have_feature)
+        os.chdir(self.tmp)
+        os.environ['PATH'] = self.bin_dir
+        util.have_feature = lambda check: check == 'emit_relocs'
+
+    def tearDown(self):
+        cwd, path, util.have_feature = self.saved
+        os.environ['PATH'] = path
+        os.chdir(cwd)
+        shutil.rmtree(self.tmp)
+
+    def stub(self, name, version='17.0.6'):
+        fn = os.path.join(self.bin_dir, name)
+        with open(fn, 'w') as f:
+            # only shell builtins, PATH holds nothing but the stubs
+            output = (VERSION_OUTPUT % version).replace('\n', '\\n')
+            f.write("#!/bin/sh\nprintf '%s'\n" % output)
+        os.chmod(fn, os.stat(fn).st_mode | stat.S_IXUSR)
+        return fn
+
+    def configure(self, *argv):
+        options = args_parser.creat_parser({'minimum_icu': 64}).parse_known_args(
+            ['--enable-bolt'] + list(argv))[0]
+        o = {'variables': {}}
+        util.configure_bolt(o, options)
+        return o
+
+    def read(self, fn):
+        with open(fn) as f:
+            return f.read()
+
+    def test_instrument_make(self):
+        llvm_bolt = self.stub('llvm-bolt')
+        merge_fdata = self.stub('merge-fdata')
+        o = self.configure('--bolt-train-cmd', '$BOLT_NODE bench.js')
+        self.assertEqual(o['variables']['node_use_bolt'], 'true')
+        self.assertIn('-Wl,--emit-relocs', o['ldflags'])
+        mk = self.read('bolt.mk')
+        self.assertIn('LLVM_BOLT ?= %s\n' % llvm_bolt, mk)
+        self.assertIn('MERGE_FDATA ?= %s\n' % merge_fdata, mk)
+        self.assertIn('BOLT_NODE_IN ?= out/Release/node\n', mk)
+        self.assertIn('BOLT_TRAIN ?= $$BOLT_NODE bench.js\n', mk)
+        self.assertIn('-instrument -instrumentation-file=$(BOLT_DIR)/node.fdata', mk)
+        self.assertNotIn('$(PERF2BOLT) $(BOLT_NODE_IN)', mk)
+        self.assertFalse(os.path.exists('bolt.ninja'))
+
+    def test_perf_ninja(self):
+        llvm_bolt = self.stub('llvm-bolt')
+        perf2bolt = self.stub('perf2bolt')
+        self.stub('perf')
+        self.configure('--bolt-mode=perf', '--ninja', '--out-dir', 'out/bolt')
+        ninja = self.read('out/bolt/bolt.ninja')
+        self.assertIn('bolt_dir = out/bolt/Release/bolt\n', ninja)
+        self.assertIn('perf record -e cycles:u -j any,u', ninja)
+        self.assertIn('%s $in -p $bolt_dir/perf.data -o $out' % perf2bolt, ninja)
+        self.assertIn('command = %s $in -o $out -data=$bolt_dir/node.fdata' % llvm_bolt,
+                      ninja)
+        self.assertIn('build out/bolt/Release/node.bolt: bolt_optimize '
+                      'out/bolt/Release/node | $bolt_dir/node.fdata\n', ninja)
+        self.assertFalse(os.path.exists('bolt.mk'))
+
+    def test_version_mismatch(self):
+        self.stub('llvm-bolt', '17.0.6')
+        self.stub('perf2bolt', '16.0.0')
+        self.stub('perf')
+        with self.assertRaises(SystemExit):
+            self.configure('--bolt-mode=perf')
+        self.assertFalse(os.path.exists('bolt.mk'))
+
+    def test_missing_tool(self):
+        self.stub('llvm-bolt')
+        with self.assertRaises(SystemExit):
+            self.configure('--bolt-mode=perf')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'node_configure'))
+import args_parser
+import util
+from phase_cache import PhaseCache
+from scheduler import Phase
+
+
+class SharedLibraryTest(unittest.TestCase):
+    """configure_library run through PhaseCache, as exec.configure does,
+    without pkg-config."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.saved = (os.environ.get('PKG_CONFIG'), getattr(util, 'flavor', None))
+        os.environ['PKG_CONFIG'] = os.path.join(self.tmp, 'no-pkg-config')
+        util.flavor = 'linux'
+        self.phase = Phase('zlib', lambda o, options:
+                           util.configure_library(options, 'zlib', o))
+
+    def tearDown(self):
+        pkg_config, util.flavor = self.saved
+        if pkg_config is None:
+            del os.environ['PKG_CONFIG']
+        else:
+            os.environ['PKG_CONFIG'] = pkg_config
+        shutil.rmtree(self.tmp)
+
+    def run_phase(self, *argv):
+        options = args_parser.creat_parser({'minimum_icu': 64}).parse_known_args(
+            list(argv))[0]
+        cache = PhaseCache(os.path.join(self.tmp, 'phases.pickle'))
+        o = {'variables': {}, 'include_dirs': [], 'libraries': []}
+        contrib, _ = cache.run(self.phase, {}, o, options)
+        cache.save()
+        return cache, contrib
+
+    def test_shared_zlib(self):
+        cache, contrib = self.run_phase(
+            '--shared-zlib', '--shared-zlib-includes', '/opt/zlib/include',
+            '--shared-zlib-libpath', '/opt/zlib/lib')
+        self.assertEqual(cache.misses, ['zlib'])
+        self.assertEqual(contrib['variables']['node_shared_zlib'], 'true')
+        self.assertEqual(contrib['include_dirs'], ['/opt/zlib/include'])
+        self.assertEqual(contrib['libraries'], ['-L/opt/zlib/lib', '-lz'])
+
+    def test_options_read_key_the_entry(self):
+        argv = ['--shared-zlib', '--shared-zlib-libpath', '/opt/zlib/lib']
+        self.run_phase(*argv)
+        cache, contrib = self.run_phase(*argv)
+        self.assertEqual(cache.hits, ['zlib'])
+        self.assertEqual(contrib['libraries'], ['-L/opt/zlib/lib', '-lz'])
+        cache, contrib = self.run_phase('--shared-zlib', '--shared-zlib-libpath',
+                                        '/usr/local/lib')
+        self.assertEqual(cache.misses, ['zlib'])
+        self.assertEqual(contrib['libraries'], ['-L/usr/local/lib', '-lz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'node_configure'))
+import section_order
+
+SAMPLE = os.path.join(root, 'RESOURCES', 'section_ordering_sample.perf')
+
+# call-chain clusters of the sample: every function follows its most
+# frequent caller, from main down to the hot leaves
+SAMPLE_NODE_ORDER = [
+    '_ZN4node5StartEiPPc',
+    'uv_run',
+    'uv__io_poll',
+    'uv__run_timers',
+    '_ZN4node11Environment9RunTimersEP10uv_timer_s',
+    '_ZN2v88internal4Heap26AllocateRawWithRetryOrFailEi',
+    '_ZN2v88internal4Heap14CollectGarbageENS0_15AllocationSpaceE',
+    'uv__stream_io',
+    'uv__read',
+    '_ZN4node10LibuvStreamWrap6OnReadEmPK8uv_buf_t',
+    '_ZN4node10StreamBase9WriteVEP5uv_buf_tmP8uv_stream_s',
+]
+
+
+class GenerateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmp, 'section_ordering.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def read_output(self):
+        with open(self.output) as f:
+            return f.read().splitlines()
+
+    def test_sample(self):
+        self.assertEqual(section_order.generate(SAMPLE, self.output), 13)
+        expected = (['__libc_start_main'] + SAMPLE_NODE_ORDER +
+                    ['__memmove_avx_unaligned_erms'])
+        self.assertEqual(self.read_output(), ['.text.' + sym for sym in expected])
+
+    def test_sample_dso(self):
+        section_order.generate(SAMPLE, self.output, dso='bin/node')
+        self.assertEqual(self.read_output(),
+                         ['.text.' + sym for sym in SAMPLE_NODE_ORDER])
+
+    def test_collapsed(self):
+        profile = os.path.join(self.tmp, 'collapsed.txt')
+        with open(profile, 'w') as f:
+            f.write('main;uv_run;uv__io_poll 3\n'
+                    'main;uv_run;uv__run_timers 1\n')
+        self.assertEqual(section_order.generate(profile, self.output), 4)
+        self.assertEqual(self.read_output(),
+                         ['.text.main', '.text.uv_run', '.text.uv__io_poll',
+                          '.text.uv__run_timers'])
+
+    def test_collapsed_rejects_dso(self):
+        profile = os.path.join(self.tmp, 'collapsed.txt')
+        with open(profile, 'w') as f:
+            f.write('main;uv_run 1\n')
+        with self.assertRaises(SystemExit):
+            section_order.generate(profile, self.output, dso='bin/node')
+        self.assertFalse(os.path.exists(self.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
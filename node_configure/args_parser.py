@@ -1,5 +1,6 @@
 import argparse
 import nodedownload
+import prefetch
 
 def creat_parser(icu_versions):
     parser = argparse.ArgumentParser()
@@ -11,6 +12,10 @@ def creat_parser(icu_versions):
     valid_mips_fpu = ('fp32', 'fp64', 'fpxx')
     valid_mips_float_abi = ('soft', 'hard')
     valid_intl_modes = ('none', 'small-icu', 'full-icu', 'system-icu')
+    valid_compiler_caches = ('auto', 'ccache', 'sccache', 'none')
+    valid_lto_modes = ('full', 'thin')
+    valid_linkers = ('auto', 'bfd', 'gold', 'lld', 'mold')
+    valid_bolt_modes = ('instrument', 'perf')
     # create option groups
     shared_optgroup = parser.add_argument_group(
         "Shared libraries",
@@ -34,6 +39,13 @@ def creat_parser(icu_versions):
         dest='prefix',
         default='/usr/local',
         help='select the install prefix [default: %(default)s]')
+    parser.add_argument('--compiler-cache',
+        action='store',
+        dest='compiler_cache',
+        default='none',
+        choices=valid_compiler_caches,
+        help='wrap CC and CXX with a compiler cache ({0}) [default: %(default)s]'.format(
+            ', '.join(valid_compiler_caches)))
     parser.add_argument('--coverage',
         action='store_true',
         dest='coverage',
@@ -113,12 +125,72 @@ def creat_parser(icu_versions):
         default=None,
         help="Enable use of the profile generated with --enable-pgo-generate. This "
              "feature is only available on linux with gcc and g++ 5.4.1 or newer.")
-    parser.add_argument("--enable-lto",
+    parser.add_argument("--enable-bolt",
         action="store_true",
+        dest="enable_bolt",
+        default=None,
+        help="Link node with --emit-relocs and generate bolt.mk (bolt.ninja with "
+             "--ninja) to optimize the binary with llvm-bolt after a training "
+             "run. This feature is only available on linux.")
+    parser.add_argument("--bolt-mode",
+        action="store",
+        dest="bolt_mode",
+        default="instrument",
+        choices=valid_bolt_modes,
+        help="How --enable-bolt collects the profile: instrument the binary "
+             "with llvm-bolt or sample it with perf and convert with perf2bolt "
+             "({0}) [default: %(default)s]".format(', '.join(valid_bolt_modes)))
+    parser.add_argument("--bolt-train-cmd",
+        action="store",
+        dest="bolt_train_cmd",
+        help="Shell command for the BOLT training run, $BOLT_NODE is the node "
+             "binary to run [default: $BOLT_NODE benchmark/run.js]")
+    parser.add_argument("--enable-lto",
+        action="store",
         dest="enable_lto",
+        nargs="?",
+        const="full",
         default=None,
+        choices=valid_lto_modes,
         help="Enable compiling with lto of a binary. This feature is only available "
-             "on linux with gcc and g++ 5.4.1 or newer.")
+             "on linux with gcc and g++ 5.4.1 or newer (full, the default) or "
+             "with clang and clang++ 5.0.0 or newer and lld or the LLVM gold "
+             "plugin (thin).")
+    parser.add_argument("--thin-lto-cache-dir",
+        action="store",
+        dest="thin_lto_cache_dir",
+        help="ThinLTO cache directory for --enable-lto=thin "
+             "[default: thinlto-cache in the output directory]")
+    parser.add_argument("--thin-lto-cache-policy",
+        action="store",
+        dest="thin_lto_cache_policy",
+        default="prune_after=168h:cache_size=10%:cache_size_bytes=20g",
+        help="ThinLTO cache pruning policy for --enable-lto=thin "
+             "[default: %(default)s]")
+    parser.add_argument('--jobs',
+        action='store',
+        dest='jobs',
+        type=int,
+        help='number of parallel compile jobs written to config.mk '
+             '[default: computed from CPUs, cgroup quota and memory]')
+    parser.add_argument('--link-jobs',
+        action='store',
+        dest='link_jobs',
+        type=int,
+        help='number of parallel link jobs (ninja link pool depth) '
+             '[default: computed from CPUs, cgroup quota and memory]')
+    parser.add_argument('--lto-jobs',
+        action='store',
+        dest='lto_jobs',
+        type=int,
+        help='ThinLTO backend jobs per link when --enable-lto=thin is given '
+             '[default: CPUs divided by link jobs]')
+    parser.add_argument('--linker',
+        action='store',
+        dest='linker',
+        choices=valid_linkers,
+        help='linker to use ({0}); auto picks the fastest one that links '
+             'with CC [default: compiler default]'.format(', '.join(valid_linkers)))
     parser.add_argument("--link-module",
         action="append",
         dest="linked_module",
@@ -480,6 +552,19 @@ def creat_parser(icu_versions):
         dest='download_path',
         default='deps',
         help='Download directory [default: %(default)s]')
+    intl_optgroup.add_argument('--download-mirror',
+        action='append',
+        dest='download_mirrors',
+        default=[],
+        help='URL prefix to also fetch downloads from, e.g. a regional mirror; '
+             'can be given several times, as can ${0} (whitespace or comma '
+             'separated). The fastest source with a matching hash is used'.format(
+                 nodedownload.MIRRORS_ENV))
+    intl_optgroup.add_argument('--download-bundle',
+        action='store',
+        dest='download_bundle',
+        help='bundle written by `node_configure prefetch` to take downloads '
+             'from before fetching them [default: ${0}]'.format(prefetch.BUNDLE_ENV))
     parser.add_argument_group(intl_optgroup)
     parser.add_argument('--debug-lib',
         action='store_true',
@@ -544,6 +629,22 @@ def creat_parser(icu_versions):
         dest='use_ninja',
         default=None,
         help='generate build files for use with Ninja')
+    parser.add_argument('--force-gyp',
+        action='store_true',
+        dest='force_gyp',
+        default=None,
+        help='run gyp even if its inputs are unchanged since the last generation')
+    parser.add_argument('--force-configure',
+        action='store_true',
+        dest='force_configure',
+        default=None,
+        help='rerun every configure phase instead of reusing cached results')
+    parser.add_argument('--out-dir',
+        action='store',
+        dest='out_dir',
+        help='directory for the config files and the build of this variant, '
+             'e.g. out/asan-debug, so variants do not overwrite each other '
+             '[default: config files in the source tree, build in out/]')
     parser.add_argument('--enable-asan',
         action='store_true',
         dest='enable_asan',
@@ -3,9 +3,163 @@ import os
 import argparse
 import pkg_resources
 
-import node_configure 
+import node_configure
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def creat_cmd_parser():
+    parser = argparse.ArgumentParser(prog='node_configure')
+    subparsers = parser.add_subparsers(dest='cmd')
+    serve_parser = subparsers.add_parser('serve',
+        help='keep toolchain probes warm and answer configure requests on a unix socket')
+    serve_parser.add_argument('--socket',
+        action='store',
+        dest='socket',
+        help='unix socket path [default: $NODE_CONFIGURE_SOCKET or /tmp/node_configure-UID.sock]')
+    client_parser = subparsers.add_parser('configure',
+        help='forward configure arguments, env and cwd to a running daemon')
+    client_parser.add_argument('--socket',
+        action='store',
+        dest='socket',
+        help='unix socket path of the daemon')
+    client_parser.add_argument('configure_args',
+        nargs=argparse.REMAINDER,
+        help='arguments passed on to configure')
+    pgo_parser = subparsers.add_parser('pgo',
+        help='instrumented build, training run and profile-guided rebuild')
+    pgo_parser.add_argument('--train-cmd',
+        action='store',
+        dest='train_cmd',
+        required=True,
+        help='shell command running the training workload with the instrumented binary')
+    pgo_parser.add_argument('--configure-cmd',
+        action='store',
+        dest='configure_cmd',
+        default='./configure',
+        help='configure command [default: %(default)s]')
+    pgo_parser.add_argument('--build-cmd',
+        action='store',
+        dest='build_cmd',
+        default='make',
+        help='build command [default: %(default)s]')
+    pgo_parser.add_argument('--profile-dir',
+        action='store',
+        dest='profile_dir',
+        help='where profiles are stored, one directory per source revision '
+             'and options [default: .pgo-profiles]')
+    pgo_parser.add_argument('--force',
+        action='store_true',
+        dest='force',
+        default=False,
+        help='record a new profile even if a matching one is stored')
+    pgo_parser.add_argument('configure_args',
+        nargs=argparse.REMAINDER,
+        help='arguments passed on to configure')
+    order_parser = subparsers.add_parser('section-order',
+        help='generate a --use-section-ordering-file from a recorded profile')
+    order_parser.add_argument('profile',
+        help='`perf script --no-demangle` output or a collapsed call graph '
+             '(frame;frame;...;leaf count per line)')
+    order_parser.add_argument('-o', '--output',
+        action='store',
+        dest='output',
+        default='section_ordering.txt',
+        help='ordering file to write [default: %(default)s]')
+    order_parser.add_argument('--format',
+        action='store',
+        dest='format',
+        default='auto',
+        choices=('auto', 'perf', 'collapsed'),
+        help='profile format [default: %(default)s]')
+    order_parser.add_argument('--dso',
+        action='store',
+        dest='dso',
+        help='only order functions from DSOs whose path contains this, e.g. '
+             'bin/node (perf script input only)')
+    order_parser.add_argument('--cluster-size',
+        action='store',
+        dest='cluster_size',
+        type=int,
+        default=64,
+        help='maximum number of functions per call-chain cluster [default: %(default)s]')
+    prefetch_parser = subparsers.add_parser('prefetch',
+        help='download, verify and bundle the ICU archives for offline configures')
+    prefetch_parser.add_argument('--dep-file',
+        action='store',
+        dest='dep_file',
+        default=os.path.join('tools', 'icu', 'current_ver.dep'),
+        help='archives to fetch [default: %(default)s]')
+    prefetch_parser.add_argument('--icu-versions',
+        action='store',
+        dest='icu_versions_fn',
+        help='icu_versions.json; archives older than its minimum_icu are skipped')
+    prefetch_parser.add_argument('--download-mirror',
+        action='append',
+        dest='download_mirrors',
+        default=[],
+        help='URL prefix to also fetch from, as for configure')
+    prefetch_parser.add_argument('-j', '--jobs',
+        action='store',
+        dest='jobs',
+        type=int,
+        help='concurrent downloads [default: one per archive]')
+    prefetch_parser.add_argument('-o', '--output',
+        action='store',
+        dest='output',
+        default='icu-bundle.zip',
+        help='bundle to write, for configure --download-bundle [default: %(default)s]')
+    cc_parser = subparsers.add_parser('compile-commands',
+        help='update compile_commands.json from the gyp files without a full gyp run')
+    cc_parser.add_argument('--out-dir',
+        action='store',
+        dest='out_dir',
+        help='output directory given to configure [default: out]')
+    cc_parser.add_argument('--force',
+        action='store_true',
+        dest='force',
+        default=False,
+        help='process every build file, not only those affected by changes')
+    watch_parser = subparsers.add_parser('watch',
+        help='configure, then configure again whenever a file it read changes')
+    watch_parser.add_argument('configure_args',
+        nargs=argparse.REMAINDER,
+        help='arguments passed on to configure')
+    return(parser)
 
 
 def main():
-    print("command line bin of node_configure !!")
+    parser = creat_cmd_parser()
+    cmd_options = parser.parse_args()
+    if cmd_options.cmd == 'serve':
+        import daemon
+        daemon.serve(cmd_options.socket)
+    elif cmd_options.cmd == 'configure':
+        import daemon
+        sys.exit(daemon.client(cmd_options.configure_args, cmd_options.socket))
+    elif cmd_options.cmd == 'pgo':
+        import pgo
+        pgo.pgo(os.getcwd(), cmd_options.configure_args, cmd_options.train_cmd,
+                profile_root=cmd_options.profile_dir,
+                configure_cmd=cmd_options.configure_cmd,
+                build_cmd=cmd_options.build_cmd,
+                force=cmd_options.force)
+    elif cmd_options.cmd == 'section-order':
+        import section_order
+        section_order.generate(cmd_options.profile, cmd_options.output,
+                               fmt=cmd_options.format, dso=cmd_options.dso,
+                               cluster_size=cmd_options.cluster_size)
+    elif cmd_options.cmd == 'prefetch':
+        import prefetch
+        prefetch.prefetch(cmd_options.dep_file, cmd_options.output,
+                          icu_versions_fn=cmd_options.icu_versions_fn,
+                          mirrors=cmd_options.download_mirrors,
+                          jobs=cmd_options.jobs)
+    elif cmd_options.cmd == 'compile-commands':
+        import compile_commands
+        sys.exit(compile_commands.update(cmd_options.out_dir, force=cmd_options.force))
+    elif cmd_options.cmd == 'watch':
+        import watch
+        sys.exit(watch.watch(os.getcwd(), cmd_options.configure_args))
+    else:
+        print("command line bin of node_configure !!")
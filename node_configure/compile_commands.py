@@ -0,0 +1,254 @@
+from __future__ import print_function
+import json
+import os
+import pickle
+import sys
+import time
+
+import gyp_node
+import util
+from gyp_node import gyp, file_hash, load_inputs_stamp
+from gyp_parse_cache import ParseCache
+
+# Below the output directory: the gyp input graph of the last compilation
+# database update (small, read on every update) and its entries per build
+# file (read only when something changed).
+graph_name = '.compile_commands.graph'
+entries_name = '.compile_commands.entries'
+
+GENERATOR = 'gyp.generator.compile_commands_json'
+
+
+def load_pickle(path, default):
+  try:
+    with open(path, 'rb') as f:
+      return pickle.load(f)
+  except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+    return default
+
+
+def save_pickle(path, data):
+  tmp = '%s.%d.tmp' % (path, os.getpid())
+  with open(tmp, 'wb') as f:
+    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+  os.replace(tmp, path)
+
+
+def gyp_args(stamp_args):
+  """The arguments of the last configure's gyp run, minus its generators
+  and root build file. Returns (args, root, files given with -I)."""
+  args = []
+  root = None
+  includes = []
+  it = iter(stamp_args)
+  for arg in it:
+    if arg == '-f':
+      next(it, None)
+    elif arg in ('-I', '--generator-output'):
+      value = next(it, None)
+      if arg == '-I':
+        includes.append(os.path.abspath(value))
+      args += [arg, value]
+    elif arg.endswith('.gyp') and not arg.startswith('-'):
+      root = arg
+    else:
+      args.append(arg)
+  return (args, root, includes)
+
+
+def affected_build_files(graph, changed):
+  """Build files loading one of the changed files, and those depending on
+  them (their targets inherit direct_dependent_settings)."""
+  affected = set(bf for bf, sources in graph['sources'].items() if sources & changed)
+  grown = True
+  while grown:
+    grown = False
+    for bf, deps in graph['deps'].items():
+      if bf not in affected and deps & affected:
+        affected.add(bf)
+        grown = True
+  return affected
+
+
+def prune(graph, entries, root):
+  """Drops the build files that no longer exist or that no target reachable
+  from the root build file depends on any more. Returns how many."""
+  reachable = set()
+  todo = [os.path.abspath(root)]
+  while todo:
+    bf = todo.pop()
+    if bf in reachable:
+      continue
+    reachable.add(bf)
+    todo.extend(graph['deps'].get(bf, ()))
+  gone = [bf for bf in set(entries) | set(graph['sources'])
+          if bf not in reachable or not os.path.isfile(bf)]
+  for bf in gone:
+    entries.pop(bf, None)
+    graph['sources'].pop(bf, None)
+    graph['deps'].pop(bf, None)
+  return len(gone)
+
+
+def config_lock(out_dir):
+  """The lock exec.configure holds while writing the config files and the
+  gyp output of out_dir, which compile_commands.json is part of."""
+  if out_dir == gyp_node.output_dir:
+    return os.path.join(gyp_node.node_root, 'config')
+  return os.path.join(out_dir, 'config')
+
+
+def run_generator(args, roots, out_dir):
+  """Runs gyp on the root build files with the compile_commands_json
+  generator, collecting its commands per build file instead of letting it
+  write them. Returns (rc, {build file: {configuration: [commands]}},
+  {build file: set of files it loaded}, {build file: set of build files
+  its targets depend on}, output directory of the generator)."""
+  module = __import__(GENERATOR, fromlist=['*'])
+  entries = {}
+  sources = {}
+  deps = {}
+  dest = []
+
+  def generate_output(target_list, target_dicts, data, params):
+    for build_file, build_data in data.items():
+      if not isinstance(build_data, dict):
+        continue  # data['target_build_files']
+      bf = os.path.abspath(build_file)
+      base = os.path.dirname(build_file)
+      sources[bf] = set([bf]).union(os.path.abspath(os.path.join(base, inc))
+                                    for inc in build_data.get('included_files', []))
+      entries.setdefault(bf, {})
+      deps.setdefault(bf, set())
+    for qualified_target, target in target_dicts.items():
+      build_file = gyp.common.ParseQualifiedTarget(qualified_target)[0]
+      bf = os.path.abspath(build_file)
+      if module.IsMac(params):
+        gyp.xcode_emulation.MergeGlobalXcodeSettingsToSpec(data[build_file], target)
+      module.AddCommandsForTarget(os.path.dirname(build_file), target, params, entries[bf])
+      for dep in target.get('dependencies', []):
+        deps[bf].add(os.path.abspath(gyp.common.ParseQualifiedTarget(dep)[0]))
+    dest.append(params['generator_flags'].get('output_dir', 'out'))
+
+  parse_cache = ParseCache(os.path.join(out_dir, gyp_node.parse_cache_name))
+  parse_cache.install(gyp.input)
+  generate = module.GenerateOutput
+  module.GenerateOutput = generate_output
+  try:
+    rc = gyp.main(args + ['-f', 'compile_commands_json'] + roots)
+  finally:
+    module.GenerateOutput = generate
+    parse_cache.uninstall()
+  return (rc, entries, sources, deps, dest[0] if dest else 'out')
+
+
+def write_databases(graph, entries):
+  """Writes <output_dir>/<configuration>/compile_commands.json from the
+  entries of every build file, each through a temporary file and a rename
+  and only if it changed. Returns the number of files written."""
+  per_config = {}
+  for bf in sorted(entries):
+    for config, commands in entries[bf].items():
+      per_config.setdefault(config, []).extend(commands)
+  written = 0
+  for config, commands in sorted(per_config.items()):
+    filename = os.path.join(graph['dest'], config, 'compile_commands.json')
+    data = json.dumps(commands, indent=0, check_circular=False)
+    try:
+      with open(filename) as f:
+        if f.read() == data:
+          continue
+    except (IOError, OSError):
+      pass
+    if not os.path.isdir(os.path.dirname(filename)):
+      os.makedirs(os.path.dirname(filename))
+    tmp = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp, 'w') as f:
+      f.write(data)
+    os.replace(tmp, filename)
+    written += 1
+  return written
+
+
+def databases_exist(graph):
+  return all(os.path.isfile(os.path.join(graph['dest'], config, 'compile_commands.json'))
+             for config in graph['configs'])
+
+
+def update(out_dir=None, force=False):
+  """Brings compile_commands.json up to date with the gyp files, using the
+  gyp arguments of the last configure. Only the build files loading a
+  changed .gyp/.gypi (and those depending on them) are processed again,
+  unless an -I file such as config.gypi changed. Returns 0 on success."""
+  out_dir = os.path.abspath(out_dir) if out_dir else gyp_node.output_dir
+  # a configure in this tree rewrites the stamp and the databases
+  with util.file_lock(config_lock(out_dir)):
+    return update_locked(out_dir, force)
+
+
+def update_locked(out_dir, force):
+  start = time.time()
+  stamp = load_inputs_stamp(out_dir)
+  if not stamp:
+    print('No gyp inputs stamp in %s, run configure first' % out_dir)
+    return 1
+  args, root, includes = gyp_args(stamp['args'])
+  graph_file = os.path.join(out_dir, graph_name)
+  entries_file = os.path.join(out_dir, entries_name)
+  graph = None if force else load_pickle(graph_file, None)
+  if graph is not None and graph['args'] != stamp['args']:
+    graph = None
+
+  roots = [root]
+  if graph is not None:
+    changed = set(path for path, digest in graph['files'].items()
+                  if file_hash(path) != digest)
+    if not changed:
+      if databases_exist(graph):
+        print('compile_commands.json is up to date (%.2fs)' % (time.time() - start))
+        return 0
+      entries = load_pickle(entries_file, None)
+      if entries is not None:
+        write_databases(graph, entries)
+        print('compile_commands.json restored (%.2fs)' % (time.time() - start))
+        return 0
+      graph = None
+    elif changed & set(includes):
+      graph = None  # every target sees the -I files
+    else:
+      roots = sorted(affected_build_files(graph, changed))
+      if not all(os.path.isfile(bf) for bf in roots):
+        graph = None
+        roots = [root]
+
+  entries = {} if graph is None else load_pickle(entries_file, None)
+  if entries is None:
+    graph = None
+    roots = [root]
+    entries = {}
+  rc, new_entries, sources, deps, dest = run_generator(args, roots, out_dir)
+  if rc != 0:
+    print('Error running GYP')
+    return rc
+  if graph is None:
+    graph = {'args': stamp['args'], 'sources': {}, 'deps': {}}
+  entries.update(new_entries)
+  graph['sources'].update(sources)
+  graph['deps'].update(deps)
+  pruned = prune(graph, entries, root)
+  graph['dest'] = dest
+  graph['configs'] = sorted(set(config for per_config in entries.values()
+                                for config in per_config))
+  graph['files'] = dict((path, file_hash(path)) for path in
+                        set().union(*graph['sources'].values()))
+  written = write_databases(graph, entries)
+  save_pickle(entries_file, entries)
+  save_pickle(graph_file, graph)
+  print('compile_commands.json: %d of %d build files processed, %d dropped, '
+        '%d databases written (%.2fs)' % (len(new_entries), len(entries), pruned,
+                                          written, time.time() - start))
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(update(*sys.argv[1:2]))
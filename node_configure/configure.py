@@ -3,7 +3,6 @@ import util
 import json
 import os
 import pipes
-import pprint
 from gyp.common import GetFlavor
 import sys
 #from gyp_node import run_gyp
@@ -54,7 +53,7 @@ def handle_fips(output,options):
     if 'make_fips_settings' in output:
         config_fips['make_global_settings'] = output['make_fips_settings']
         del output['make_fips_settings']
-        write('config_fips.gypi', util.do_not_edit +pprint.pformat(config_fips, indent=2) + '\n',options)
+        util.write_gypi(util.config_path('config_fips.gypi', options), config_fips, options)
     return(config_fips)
 
 
@@ -77,18 +76,21 @@ def save_config_gypi(output,options,variables):
       'target_defaults': output,
     }
     util.print_verbose(output,options)
-    util.write('config.gypi', util.do_not_edit +pprint.pformat(output, indent=2) + '\n',options)
+    util.write_gypi(util.config_path('config.gypi', options), output, options)
 
 
 
 
 def save_config_status( original_argv,options):
-    util.write('config.status', '#!/bin/sh\nset -x\nexec ./configure ' +' '.join([pipes.quote(arg) for arg in original_argv]) + '\n',options)
-    os.chmod('config.status', 0o775)
+    config_status = util.config_path('config.status', options)
+    # run from the source tree, also when it lives in --out-dir
+    cd = 'cd %s\n' % pipes.quote(os.getcwd()) if options.out_dir else ''
+    util.write_if_changed(config_status, '#!/bin/sh\nset -x\n' + cd + 'exec ./configure ' +' '.join([pipes.quote(arg) for arg in original_argv]) + '\n',options)
+    os.chmod(config_status, 0o775)
 
 
 
-def save_config_mk(options,variables):
+def save_config_mk(options,variables,jobs=None):
     config = {
       'BUILDTYPE': 'Debug' if options.debug else 'Release',
       'NODE_TARGET_TYPE': variables['node_target_type'],
@@ -103,20 +105,53 @@ def save_config_mk(options,variables):
 
     if options.use_ninja:
       config['BUILD_WITH'] = 'ninja'
+
+    if jobs:
+      # JOBS is passed as -j by the top-level Makefile
+      config['JOBS'] = str(jobs['compile'])
+      config['LINK_JOBS'] = str(jobs['link'])
+      if jobs['lto']:
+        config['LTO_JOBS'] = str(jobs['lto'])
+
+    if variables.get('compiler_cache'):
+      config['CC'] = '%s %s' % (variables['compiler_cache'], util.CC)
+      config['CXX'] = '%s %s' % (variables['compiler_cache'], util.CXX)
+      if variables['compiler_cache'] == 'ccache':
+        config['CCACHE_BASEDIR'] = os.getcwd()
     #
     # On Windows there is another find.exe in C:\Windows\System32
     if sys.platform == 'win32':
       config['FIND'] = '/usr/bin/find'
 
     config_lines = ['='.join((k,v)) for k,v in config.items()]
+    if variables.get('compiler_cache'):
+      # for the rules make runs itself; the gyp generated makefiles and
+      # build.ninja get the launcher from export_compiler_cache()
+      config_lines += ['export ' + ' '.join(
+        k for k in ('CC', 'CXX', 'CCACHE_BASEDIR') if k in config)]
     # Add a blank string to get a blank line at the end.
     config_lines += ['']
     config_str = '\n'.join(config_lines)
     # On Windows there's no reason to search for a different python binary.
-    bin_override = None if sys.platform == 'win32' else util.make_bin_override()
+    bin_override = None if sys.platform == 'win32' else util.make_bin_override(util.output_dir(options))
     if bin_override:
       config_str = 'export PATH:=' + bin_override + ':$(PATH)\n' + config_str
-    util.write('config.mk', util.do_not_edit + config_str,options)
+    util.write_if_changed(util.config_path('config.mk', options), util.do_not_edit + config_str,options)
+
+
+def export_compiler_cache(variables):
+    """Wraps CC and CXX (and their _target variants, if set) in the compiler
+    cache launcher in os.environ. The make generator writes CC.target from
+    there and the ninja generator fixes the compilers in build.ninja, so this
+    has to happen before gyp runs."""
+    launcher = variables.get('compiler_cache')
+    if not launcher:
+        return
+    os.environ['CC'] = '%s %s' % (launcher, util.CC)
+    os.environ['CXX'] = '%s %s' % (launcher, util.CXX)
+    for k in ('CC_target', 'CXX_target'):
+        if os.environ.get(k) and not os.environ[k].startswith(launcher + ' '):
+            os.environ[k] = '%s %s' % (launcher, os.environ[k])
 
 
 def creat_gyp_args(options,flavor,args):
@@ -0,0 +1,207 @@
+from __future__ import print_function
+import argparse
+import copy
+import json
+import os
+import socket
+import sys
+
+import args_parser
+import configure
+import util
+import exec as node_exec
+
+# toolchain probes whose answers only depend on the toolchain on disk and
+# the environment variables listed in util.FINGERPRINT_ENV.
+PROBES = ('pkg_config', 'try_check_compiler', 'get_version_helper',
+          'get_nasm_version', 'get_gas_version', 'cc_macros')
+
+
+def default_socket_path():
+    """Socket used by `node_configure serve` when --socket is not given."""
+    return os.environ.get('NODE_CONFIGURE_SOCKET',
+                          '/tmp/node_configure-%d.sock' % os.getuid())
+
+
+def default_request(proj_dir, argv):
+    """Build the argument namespace exec.configure expects for proj_dir."""
+    return argparse.Namespace(
+        node_version_h=os.path.join(proj_dir, 'src', 'node_version.h'),
+        node_napi_h=os.path.join(proj_dir, 'src', 'node_version.h'),
+        icu_current_ver_dep=os.path.join(proj_dir, 'tools', 'icu', 'current_ver.dep'),
+        icu_versions_fn=os.path.join(proj_dir, 'tools', 'icu', 'icu_versions.json'),
+        original_argv=argv)
+
+
+class WarmCache(object):
+    """Memoizes toolchain probes, icu_versions.json and the argparse parser
+       for the lifetime of the daemon."""
+
+    def __init__(self):
+        self.fingerprint = None
+        self.probes = {}
+        self.icu_versions = {}
+        self.parsers = {}
+        self.hits = 0
+        self.misses = 0
+
+    def validate(self, env):
+        fingerprint = util.toolchain_fingerprint(env)
+        if fingerprint != self.fingerprint:
+            if self.fingerprint is not None:
+                util.info('toolchain changed, dropping %d cached probes' % len(self.probes))
+            self.probes.clear()
+            util.linker_probes.clear()
+            self.fingerprint = fingerprint
+
+    def memoize(self, name, func):
+        def cached(*args, **kwargs):
+            key = (name, repr(args), repr(sorted(kwargs.items())))
+            if key in self.probes:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.probes[key] = func(*args, **kwargs)
+            return copy.deepcopy(self.probes[key])
+        cached.uncached = func
+        return cached
+
+    def get_icu_versions(self, fn="tools/icu/icu_versions.json"):
+        stamp = util.file_stamp(os.path.abspath(fn))
+        if stamp not in self.icu_versions:
+            self.icu_versions[stamp] = self.load_icu_versions(fn)
+        return copy.deepcopy(self.icu_versions[stamp])
+
+    def creat_parser(self, icu_versions):
+        key = json.dumps(icu_versions, sort_keys=True)
+        if key not in self.parsers:
+            self.parsers[key] = self.build_parser(icu_versions)
+        return self.parsers[key]
+
+    def install(self):
+        for name in PROBES:
+            setattr(util, name, self.memoize(name, getattr(util, name)))
+        self.load_icu_versions = configure.get_icu_versions
+        self.build_parser = args_parser.creat_parser
+        configure.get_icu_versions = self.get_icu_versions
+        args_parser.creat_parser = self.creat_parser
+
+
+class SocketWriter(object):
+    """File-like object framing everything written to it as JSON lines."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def send(self, msg):
+        self.conn.sendall((json.dumps(msg) + '\n').encode('utf-8'))
+
+    def write(self, data):
+        if data:
+            self.send({'out': util.to_utf8(data)})
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def recv_json(f):
+    line = f.readline()
+    if not line:
+        return None
+    return json.loads(util.to_utf8(line))
+
+
+def run_request(cache, req, out):
+    """Run one configure for req ({argv, env, cwd}) with output sent to out.
+       Returns the exit code."""
+    saved = (os.getcwd(), dict(os.environ), sys.stdout, sys.stderr, util.CC, util.CXX)
+    try:
+        os.chdir(req['cwd'])
+        os.environ.clear()
+        os.environ.update(req['env'])
+        util.CC = os.environ.get('CC', 'cc' if sys.platform == 'darwin' else 'gcc')
+        util.CXX = os.environ.get('CXX', 'c++' if sys.platform == 'darwin' else 'g++')
+        util.warn.warned = False
+        cache.validate(os.environ)
+        sys.stdout = sys.stderr = out
+        node_exec.configure(default_request(req['cwd'], req['argv']))
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        print('%s: %s' % (type(e).__name__, e))
+        return 1
+    finally:
+        cwd, env, sys.stdout, sys.stderr, util.CC, util.CXX = saved
+        os.environ.clear()
+        os.environ.update(env)
+        os.chdir(cwd)
+
+
+def serve(sock_path=None):
+    """Answer configure requests on a unix socket until interrupted.
+       Requests are handled one at a time since configure mutates the
+       process environment and working directory."""
+    sock_path = sock_path or default_socket_path()
+    cache = WarmCache()
+    cache.install()
+    if os.path.exists(sock_path):
+        os.unlink(sock_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # created without group and other permissions, so no other local user
+    # can connect between bind() and listen()
+    umask = os.umask(0o077)
+    try:
+        server.bind(sock_path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    util.info('node_configure serving on %s' % sock_path)
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                req = recv_json(conn.makefile('rb'))
+                if req is None:
+                    continue
+                out = SocketWriter(conn)
+                rc = run_request(cache, req, out)
+                out.send({'rc': rc, 'hits': cache.hits, 'misses': cache.misses})
+            except (IOError, OSError, ValueError) as e:
+                util.warn('dropped request: %s' % e)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(sock_path)
+
+
+def client(argv, sock_path=None):
+    """Forward argv, the environment and cwd to a running daemon and stream
+       its output. Returns the exit code of the remote configure."""
+    sock_path = sock_path or default_socket_path()
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(sock_path)
+    except (IOError, OSError) as e:
+        util.error('Cannot reach configure daemon at %s: %s' % (sock_path, e))
+    req = {'argv': list(argv), 'env': dict(os.environ), 'cwd': os.getcwd()}
+    conn.sendall((json.dumps(req) + '\n').encode('utf-8'))
+    f = conn.makefile('rb')
+    rc = 1
+    while True:
+        msg = recv_json(f)
+        if msg is None:
+            break
+        if 'out' in msg:
+            sys.stdout.write(msg['out'])
+            sys.stdout.flush()
+        if 'rc' in msg:
+            rc = msg['rc']
+    conn.close()
+    return rc
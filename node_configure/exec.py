@@ -2,8 +2,13 @@ import util
 import configure
 import os
 import nodedownload
+import prefetch
 import args_parser
 import sys
+import scheduler
+from scheduler import Phase
+from phase_cache import PhaseCache
+from gyp_node import run_gyp
 #node_version_h = "/mnt/sdb/NVNODE/node/src/node_version.h"
 #node_napi_h = "/mnt/sdb/NVNODE/node/src/node_version.h"
 #icu_current_ver_dep = "/mnt/sdb/NVNODE/node2/tools/icu/current_ver.dep"
@@ -11,6 +16,53 @@ import sys
 #proj_dir = "/mnt/sdb/NVNODE/node2"
 #original_argv = sys.argv[1:];
 
+# results of the configure phases in the output directory, see phase_cache.py.
+phase_cache_name = '.configure_phases.pickle'
+
+
+def creat_phases(flavor,node_version_h,node_napi_h,icu_versions,icu_current_ver_dep,icu_versions_fn=None):
+    """The configure steps in their serial order. reads/writes only list the
+    variables passed between phases; everything else runs concurrently, so
+    e.g. the ICU download overlaps with the compiler probes.
+    Each phase must take the options it uses from its argument, since
+    phase_cache keys its results by the options read."""
+    def library(lib, pkgname=None):
+        return Phase(lib, lambda o, options: util.configure_library(options, lib, o, pkgname=pkgname))
+    return [
+      Phase('compiler', lambda o, options: util.check_compiler(o,options),
+            writes=('llvm_version', 'xcode_version', 'gas_version', 'nasm_version')),
+      Phase('compiler_cache', lambda o, options: util.configure_compiler_cache(o,options)),
+      Phase('node', lambda o, options: util.configure_node(o,options,flavor,node_version_h),
+            writes=('target_arch', 'thin_lto_linker'), files=(node_version_h,),
+            env=('CC_host', 'PROCESSOR_ARCHITECTURE', 'PROCESSOR_ARCHITEW6432'),
+            environ=('GYP_CROSSCOMPILE',)),
+      Phase('linker', lambda o, options: util.configure_linker(o,options),
+            reads=('thin_lto_linker',), writes=('node_linker',)),
+      Phase('bolt', lambda o, options: util.configure_bolt(o,options), cache=False),
+      Phase('napi', lambda o, options: util.configure_napi(o,node_napi_h),
+            files=(node_napi_h,)),
+      library('zlib'),
+      library('http_parser'),
+      library('libuv'),
+      library('brotli', pkgname=['libbrotlidec', 'libbrotlienc']),
+      library('cares', pkgname='libcares'),
+      library('nghttp2', pkgname='libnghttp2'),
+      Phase('v8', lambda o, options: util.configure_v8(o,options)),
+      Phase('openssl', lambda o, options: util.configure_openssl(o,options),
+            reads=('target_arch', 'llvm_version', 'xcode_version', 'gas_version', 'nasm_version')),
+      Phase('intl', lambda o, options: util.configure_intl(o,options,icu_versions,icu_current_ver_dep),
+            files=(icu_current_ver_dep,) + ((icu_versions_fn,) if icu_versions_fn else ()),
+            env=(nodedownload.MIRRORS_ENV, prefetch.BUNDLE_ENV),
+            # floating patches replace ICU sources in icu_config.gypi
+            trees=(os.path.join(os.path.dirname(icu_current_ver_dep), 'patches'),)),
+      Phase('static', lambda o, options: util.configure_static(o,options)),
+      Phase('inspector', lambda o, options: util.configure_inspector(o,options)),
+      Phase('section_file', lambda o, options: util.configure_section_file(o,options),
+            reads=('node_linker',)),
+      Phase('jobs', lambda o, options: util.configure_jobs(o,options),
+            reads=('thin_lto_linker',), cache=False),
+    ]
+
 
 def configure(d):
     node_version_h = d.node_version_h;
@@ -19,52 +71,54 @@ def configure(d):
     icu_versions_fn = d.icu_versions_fn;
     original_argv = d.original_argv
     ####
-    if("with_intl" in d):
-        options.with_intl = d.with_intl
-    ####
     icu_versions= configure.get_icu_versions(icu_versions_fn)
     parser = args_parser.creat_parser(icu_versions)
-    (options, args) = parser.parse_known_args()
+    (options, args) = parser.parse_known_args(original_argv)
+    if("with_intl" in d):
+        options.with_intl = d.with_intl
     options.prefix = os.path.expanduser(options.prefix or '')
     auto_downloads = nodedownload.parse(options.download_list)
     ####
     flavor = configure.get_flavor(options)
     ####
-    output = {
-      'variables': {},
-      'include_dirs': [],
-      'libraries': [],
-      'defines': [],
-      'cflags': [],
-    }
-    util.check_compiler(output,options)
-    util.configure_node(output,options,flavor,node_version_h)
-    util.configure_napi(output,node_napi_h)
-    util.configure_library(options,'zlib', output)
-    util.configure_library(options,'http_parser', output)
-    util.configure_library(options,'libuv', output)
-    util.configure_library(options,'brotli', output, pkgname=['libbrotlidec', 'libbrotlienc'])
-    util.configure_library(options,'cares', output, pkgname='libcares')
-    util.configure_library(options,'nghttp2', output, pkgname='libnghttp2')
-    util.configure_v8(output,options)
-    util.configure_openssl(output,options)
-    ####
-    util.configure_intl(output,options,icu_versions,icu_current_ver_dep)
-    util.configure_static(output,options)
-    util.configure_inspector(output,options)
-    util.configure_section_file(output,options)
+    util.flavor = flavor  # read by configure_library, configure_static and configure_intl
+    out_dir = util.output_dir(options)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    util.feature_cache_file = os.path.join(out_dir, 'config.cache')
+    phases = creat_phases(flavor,node_version_h,node_napi_h,icu_versions,icu_current_ver_dep,icu_versions_fn)
+    cache = None if options.force_configure else PhaseCache(os.path.join(out_dir, phase_cache_name))
+    if cache is not None:
+        cache.install()
+    try:
+        (output, results) = scheduler.run_phases(phases, configure.new_output, options, cache=cache)
+    finally:
+        if cache is not None:
+            cache.uninstall()
+    if cache is not None:
+        cache.save()
+        cache.report(options)
+    jobs = results['jobs']
     variables = configure.handle_ossfuzz_and_debug(output,options)
     config_fips = configure.handle_fips(output,options)
     configure.handle_global_settings(output)
-    configure.save_config_gypi(output,options,variables);
-    configure.save_config_status(original_argv,options);
-    configure.save_config_mk(options,variables);
-    configure.creat_gyp_args(options,flavor,args)
-    ####
-    if util.warn.warned and not options.verbose:
-        util.warn('warnings were emitted in the configure phase')
-    util.print_verbose("running: \n    " + " ".join(['python', 'tools/gyp_node.py'] + gyp_args),options)
-    run_gyp(gyp_args)
+    gyp_args = configure.creat_gyp_args(options,flavor,args)
+    # config.gypi, config.mk and the gyp output of one configure belong
+    # together; another configure in this tree waits for them
+    with util.file_lock(util.config_path('config', options)):
+        configure.save_config_gypi(output,options,variables);
+        configure.save_config_status(original_argv,options);
+        configure.save_config_mk(options,variables,jobs);
+        configure.export_compiler_cache(variables)
+        ####
+        if util.warn.warned and not options.verbose:
+            util.warn('warnings were emitted in the configure phase')
+        util.print_verbose("running: \n    " + " ".join(['python', 'tools/gyp_node.py'] + gyp_args),options)
+        # a link concurrency sized from the free memory changes from run to
+        # run; rerunning gyp for it would defeat the stamp and the snapshots
+        ignore_env = () if options.link_jobs else ('GYP_LINK_CONCURRENCY',)
+        run_gyp(gyp_args, force=options.force_gyp, out_dir=options.out_dir,
+                ignore_env=ignore_env)
     util.info('configure completed successfully')
 
 
@@ -1,27 +1,187 @@
 #!/usr/bin/env python
 from __future__ import print_function
+import hashlib
+import json
 import os
 import sys
 
+try:
+  import builtins
+except ImportError:
+  import __builtin__ as builtins
+
 script_dir = os.path.dirname(__file__)
 node_root  = os.path.normpath(os.path.join(script_dir, os.pardir))
 
 sys.path.insert(0, os.path.join(node_root, 'tools', 'gyp', 'pylib'))
 import gyp
+import gyp.input
+from gyp_parse_cache import ParseCache
+from gyp_output import GeneratorOutput
+from gyp_snapshot import SnapshotStore, generator_env, snapshot_key
 
 # Directory within which we want all generated files (including Makefiles)
-# to be written.
+# to be written, unless configure is given --out-dir.
 output_dir = os.path.join(os.path.abspath(node_root), 'out')
 
-def run_gyp(args):
+# Below the output directory:
+# the gyp arguments, the environment the generators read and every
+# .gyp/.gypi gyp loaded during the last successful generation, with their
+# content hashes,
+inputs_stamp_name = '.gyp_inputs.json'
+# parsed gyp input files, see gyp_parse_cache.py,
+parse_cache_name = '.gyp_parse_cache'
+# files generated by earlier gyp runs, see gyp_snapshot.py.
+snapshot_name = '.gyp_snapshots'
+
+
+def file_hash(path):
+  try:
+    with open(path, 'rb') as f:
+      return hashlib.sha1(f.read()).hexdigest()
+  except (IOError, OSError):
+    return None
+
+
+def load_inputs_stamp(out_dir):
+  try:
+    with open(os.path.join(out_dir, inputs_stamp_name)) as f:
+      return json.load(f)
+  except (IOError, OSError, ValueError):
+    return None
+
+
+def gyp_inputs_unchanged(args, env, out_dir):
+  """True if args, env (see gyp_snapshot.generator_env) and all files loaded
+  or read by the last gyp run are unchanged. Never true after a run that
+  expanded a <!(command), whose output only running it again tells."""
+  stamp = load_inputs_stamp(out_dir)
+  if not stamp or stamp.get('args') != args:
+    return False
+  if stamp.get('env') != env:
+    return False
+  if stamp.get('commands'):
+    return False
+  for path, digest in stamp['files'].items():
+    if file_hash(path) != digest:
+      return False
+  return True
+
+
+def save_inputs_stamp(args, env, files, out_dir, commands=()):
+  stamp = {
+    'args': args,
+    'env': env,
+    'files': dict((path, file_hash(path)) for path in sorted(files)),
+    'commands': list(commands),
+  }
+  if not os.path.isdir(out_dir):
+    os.makedirs(out_dir)
+  filename = os.path.join(out_dir, inputs_stamp_name)
+  tmp = '%s.%d.tmp' % (filename, os.getpid())
+  with open(tmp, 'w') as f:
+    json.dump(stamp, f, indent=2, sort_keys=True)
+  os.replace(tmp, filename)
+
+
+class InputRecorder(object):
+  """Records what gyp reads besides the build files it loads: files opened
+  for reading below the source tree, e.g. V8's BUILD.gn read by
+  <!@pymod_do_main(GN-scraper ...), and the <!(commands) it runs in a
+  subprocess, whose inputs cannot be known."""
+
+  def __init__(self, source_dir, out_dir):
+    self.source_dir = os.path.abspath(source_dir) + os.sep
+    self.out_dir = os.path.abspath(out_dir) + os.sep
+    self.files = set()
+    self.commands = []
+    self.saved = {}
+
+  def open(self, file, mode='r', *args, **kwargs):
+    if (isinstance(file, str) and not any(c in mode for c in 'wax+')):
+      path = os.path.abspath(file)
+      if path.startswith(self.source_dir) and not path.startswith(self.out_dir):
+        self.files.add(path)
+    return self.saved['open'](file, mode, *args, **kwargs)
+
+  def popen(self, cmd, *args, **kwargs):
+    self.commands.append(cmd if isinstance(cmd, str) else ' '.join(cmd))
+    return self.saved['Popen'](cmd, *args, **kwargs)
+
+  def install(self, input_module):
+    self.saved['open'] = builtins.open
+    builtins.open = self.open
+    # gyp.input runs <!(commands) through its own subprocess reference
+    subprocess_module = input_module.subprocess
+    self.saved['subprocess'] = (input_module, subprocess_module)
+    self.saved['Popen'] = subprocess_module.Popen
+    proxy = type(subprocess_module)(subprocess_module.__name__)
+    proxy.__dict__.update(subprocess_module.__dict__)
+    proxy.Popen = self.popen
+    input_module.subprocess = proxy
+
+  def uninstall(self):
+    builtins.open = self.saved['open']
+    input_module, subprocess_module = self.saved['subprocess']
+    input_module.subprocess = subprocess_module
+    self.saved = {}
+
+
+def run_gyp_recording(args, out_dir, redirects=None):
+  """Runs gyp, returning (rc, set of build files and includes it loaded or
+  other files it read, paths of the files it generated, commands it ran).
+  redirects maps absolute paths of includes to the files loaded instead."""
+  redirects = redirects or {}
+  loaded = set()
+  parse_cache = ParseCache(os.path.join(out_dir, parse_cache_name))
+  parse_cache.install(gyp.input)
+  recorder = InputRecorder(node_root, out_dir)
+  recorder.install(gyp.input)
+  generator_output = GeneratorOutput()
+  generator_output.install()
+  load_one_build_file = gyp.input.LoadOneBuildFile
+  def recording_load(build_file_path, *rest, **kwargs):
+    build_file_path = redirects.get(os.path.abspath(build_file_path),
+                                    build_file_path)
+    loaded.add(os.path.abspath(build_file_path))
+    return load_one_build_file(build_file_path, *rest, **kwargs)
+  gyp.input.LoadOneBuildFile = recording_load
+  try:
+    rc = gyp.main(args)
+  finally:
+    gyp.input.LoadOneBuildFile = load_one_build_file
+    recorder.uninstall()
+    parse_cache.uninstall()
+    generator_output.uninstall()
+  print('gyp parse cache: %d reused, %d parsed' %
+        (parse_cache.hits, parse_cache.misses))
+  generator_output.report()
+  return (rc, loaded | recorder.files,
+          generator_output.changed + generator_output.unchanged,
+          recorder.commands)
+
+
+def run_gyp(args, force=False, out_dir=None, ignore_env=()):
+  # ignore_env: variables left out of the inputs stamp and the snapshot key,
+  # such as a GYP_LINK_CONCURRENCY derived from the free memory
   # GYP bug.
   # On msvs it will crash if it gets an absolute path.
   # On Mac/make it will crash if it doesn't get an absolute path.
   a_path = node_root if sys.platform == 'win32' else os.path.abspath(node_root)
   args.append(os.path.join(a_path, 'node.gyp'))
   common_fn = os.path.join(a_path, 'common.gypi')
-  options_fn = os.path.join(a_path, 'config.gypi')
-  options_fips_fn = os.path.join(a_path, 'config_fips.gypi')
+  # with --out-dir, configure wrote config.gypi and config_fips.gypi there
+  config_dir = os.path.abspath(out_dir) if out_dir else a_path
+  gen_dir = os.path.abspath(out_dir) if out_dir else output_dir
+  options_fn = os.path.join(config_dir, 'config.gypi')
+  options_fips_fn = os.path.join(config_dir, 'config_fips.gypi')
+  # icu-generic.gyp includes ../../icu_config.gypi, which -I could not
+  # override; with --out-dir that include loads the copy configure wrote
+  # there, and its icu_src_*.gypi includes resolve next to it
+  redirects = {}
+  if config_dir != a_path:
+    redirects[os.path.join(os.path.abspath(node_root), 'icu_config.gypi')] = \
+      os.path.join(config_dir, 'icu_config.gypi')
 
   if os.path.exists(common_fn):
     args.extend(['-I', common_fn])
@@ -36,21 +196,45 @@ def run_gyp(args):
 
   # There's a bug with windows which doesn't allow this feature.
   if sys.platform != 'win32' and 'ninja' not in args:
-    # Tell gyp to write the Makefiles into output_dir
-    args.extend(['--generator-output', output_dir])
+    # Tell gyp to write the Makefiles into gen_dir
+    args.extend(['--generator-output', gen_dir])
 
     # Tell make to write its output into the same dir
-    args.extend(['-Goutput_dir=' + output_dir])
+    args.extend(['-Goutput_dir=' + gen_dir])
+  elif out_dir and 'ninja' in args:
+    # ninja writes build.ninja below output_dir, relative to the source tree
+    args.extend(['-Goutput_dir=' + os.path.relpath(gen_dir, node_root)])
 
   args.append('-Dcomponent=static_library')
   args.append('-Dlibrary=static_library')
 
-  rc = gyp.main(args)
+  env = generator_env(os.environ, ignore_env)
+  if not force and gyp_inputs_unchanged(args, env, gen_dir):
+    print('gyp inputs are unchanged since the last generation, skipping gyp')
+    return
+
+  # switching back to a variant configured before restores its files
+  snapshots = SnapshotStore(os.path.join(gen_dir, snapshot_name), node_root)
+  key = snapshot_key(args, os.environ, ignore_env)
+  snapshot = None if force else snapshots.restore(key)
+  if snapshot is not None:
+    save_inputs_stamp(args, env, snapshot['inputs'], gen_dir)
+    return
+
+  rc, loaded, generated, commands = run_gyp_recording(args, gen_dir, redirects)
   if rc != 0:
     print('Error running GYP')
     sys.exit(rc)
+  inputs = [fn for fn in (common_fn, options_fn, options_fips_fn)
+            if os.path.exists(fn)]
+  inputs = loaded.union(os.path.abspath(fn) for fn in inputs)
+  save_inputs_stamp(args, env, inputs, gen_dir, commands)
+  if commands:
+    # their output may change without any input file changing
+    print('gyp ran %d commands, it will run again next time' % len(commands))
+  else:
+    snapshots.save(key, generated, inputs)
 
 
 if __name__ == '__main__':
   run_gyp(sys.argv[1:])
-
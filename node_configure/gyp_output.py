@@ -0,0 +1,97 @@
+from __future__ import print_function
+import io
+import os
+
+try:
+  import builtins
+except ImportError:
+  import __builtin__ as builtins
+
+# gyp generators that write their files with plain open().
+GENERATORS = ('gyp.generator.make', 'gyp.generator.ninja',
+              'gyp.generator.compile_commands_json')
+
+
+class GeneratedFile(object):
+  """File opened for writing by a gyp generator. The data is buffered and
+  only replaces the target on close() if it differs from what is on disk,
+  so make and ninja do not see unchanged .mk/.ninja files as newer."""
+
+  def __init__(self, path, mode, output):
+    self.path = path
+    self.binary = 'b' in mode
+    self.buffer = io.BytesIO() if self.binary else io.StringIO()
+    self.output = output
+    self.closed = False
+
+  def write(self, data):
+    self.buffer.write(data)
+
+  def writelines(self, lines):
+    for line in lines:
+      self.buffer.write(line)
+
+  def flush(self):
+    pass
+
+  def close(self):
+    if self.closed:
+      return
+    self.closed = True
+    data = self.buffer.getvalue()
+    if not self.binary:
+      data = data.encode('utf-8')
+    self.output.commit(self.path, data)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+class GeneratorOutput(object):
+  """Makes the gyp generators write through GeneratedFile and counts how
+  many of the files they write actually change."""
+
+  def __init__(self):
+    self.changed = []
+    self.unchanged = []
+    self.modules = []
+
+  def commit(self, path, data):
+    try:
+      with open(path, 'rb') as f:
+        if f.read() == data:
+          self.unchanged.append(path)
+          return
+    except (IOError, OSError):
+      pass
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+      f.write(data)
+    os.replace(tmp, path)
+    self.changed.append(path)
+
+  def open(self, path, mode='r', *args, **kwargs):
+    if 'w' not in mode:
+      return builtins.open(path, mode, *args, **kwargs)
+    return GeneratedFile(path, mode, self)
+
+  def install(self):
+    for name in GENERATORS:
+      try:
+        module = __import__(name, fromlist=['*'])
+      except ImportError:
+        continue
+      module.open = self.open
+      self.modules.append(module)
+
+  def uninstall(self):
+    for module in self.modules:
+      del module.open
+    self.modules = []
+
+  def report(self):
+    total = len(self.changed) + len(self.unchanged)
+    print('gyp: %d of %d generated files changed' % (len(self.changed), total))
@@ -0,0 +1,92 @@
+from __future__ import print_function
+import hashlib
+import os
+import pickle
+
+try:
+  import builtins
+except ImportError:
+  import __builtin__ as builtins
+
+
+class ParseCache(object):
+  """Persistent cache of the parsed (pre variable expansion) contents of gyp
+  input files, stored as pickles keyed by file path and content hash.
+
+  gyp.input evaluates every .gyp/.gypi with eval() (or CheckedEval() when
+  --check is given); install() shadows both in the gyp.input module so that
+  files whose contents are unchanged are unpickled instead of re-evaluated.
+  Each load returns fresh objects, since gyp mutates the data it loads."""
+
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    self.current_path = None
+    self.hits = 0
+    self.misses = 0
+    self.module = None
+
+  def entry(self, contents, check):
+    path_key = hashlib.sha1((self.current_path or '').encode('utf-8')).hexdigest()
+    content_key = hashlib.sha1(
+      (contents if isinstance(contents, bytes) else contents.encode('utf-8'))).hexdigest()
+    key = '%s-%s' % (path_key, content_key)
+    return (key, '%s%s.pickle' % (key, '-check' if check else ''))
+
+  def load(self, contents, check, parse):
+    key, name = self.entry(contents, check)
+    fn = os.path.join(self.cache_dir, name)
+    try:
+      with open(fn, 'rb') as f:
+        data = pickle.load(f)
+      self.hits += 1
+      return data
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+      pass
+    data = parse()
+    self.misses += 1
+    self.store(key, fn, data)
+    return data
+
+  def store(self, key, fn, data):
+    if not os.path.isdir(self.cache_dir):
+      os.makedirs(self.cache_dir)
+    # drop entries for older contents of the same file
+    path_key = key.split('-')[0]
+    for old in os.listdir(self.cache_dir):
+      if old.startswith(path_key + '-') and not old.startswith(key):
+        os.unlink(os.path.join(self.cache_dir, old))
+    tmp = '%s.%d.tmp' % (fn, os.getpid())
+    with open(tmp, 'wb') as f:
+      pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, fn)
+
+  def cached_eval(self, source, globals=None, locals=None):
+    # gyp.input also uses eval() for compiled condition expressions with a
+    # variables dict as locals; only whole build files are cached.
+    if not isinstance(source, (str, bytes)) or locals is not None:
+      return builtins.eval(source, globals, locals)
+    return self.load(source, False,
+                     lambda: builtins.eval(source, globals, locals))
+
+  def install(self, gyp_input):
+    self.module = gyp_input
+    self.checked_eval = gyp_input.CheckedEval
+    self.load_one_build_file = gyp_input.LoadOneBuildFile
+    cache = self
+    def load_one_build_file(build_file_path, *args, **kwargs):
+      # eval happens before the includes of a file are loaded recursively,
+      # so current_path names the file being parsed.
+      cache.current_path = os.path.abspath(build_file_path)
+      return cache.load_one_build_file(build_file_path, *args, **kwargs)
+    gyp_input.LoadOneBuildFile = load_one_build_file
+    gyp_input.eval = self.cached_eval
+    gyp_input.CheckedEval = lambda contents: self.load(
+      contents, True, lambda: self.checked_eval(contents))
+
+  def uninstall(self):
+    if self.module is None:
+      return
+    del self.module.eval
+    self.module.CheckedEval = self.checked_eval
+    self.module.LoadOneBuildFile = self.load_one_build_file
+    self.module = None
@@ -0,0 +1,191 @@
+from __future__ import print_function
+import hashlib
+import json
+import os
+import time
+
+# snapshots kept; the least recently used ones are dropped first
+MAX_SNAPSHOTS = 8
+
+# environment variables the gyp generators bake into their output, besides
+# every GYP_* variable.
+GENERATOR_ENV = ('CC', 'CXX', 'AR', 'LINK', 'CC_host', 'CXX_host', 'AR_host',
+                 'LINK_host', 'CC_target', 'CXX_target', 'AR_target',
+                 'LINK_target', 'CFLAGS', 'CXXFLAGS', 'LDFLAGS')
+
+
+def data_hash(data):
+  return hashlib.sha1(data).hexdigest()
+
+
+def file_hash(path):
+  try:
+    with open(path, 'rb') as f:
+      return data_hash(f.read())
+  except (IOError, OSError):
+    return None
+
+
+def generator_env(environ, ignore=()):
+  """Sorted (name, value) pairs of the GYP_* and GENERATOR_ENV variables,
+  without those in ignore."""
+  return sorted([k, v] for k, v in environ.items()
+                if (k.startswith('GYP_') or k in GENERATOR_ENV) and k not in ignore)
+
+
+def snapshot_key(args, environ, ignore=()):
+  """Fingerprint of a gyp run before it starts: the arguments, which name
+  config.gypi, config_fips.gypi and common.gypi, the contents of the files
+  given with -I and the environment the generators read, except the
+  variables in ignore."""
+  includes = [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == '-I']
+  key = json.dumps([args, [(fn, file_hash(fn)) for fn in includes],
+                    generator_env(environ, ignore)])
+  return data_hash(key.encode('utf-8'))
+
+
+class SnapshotStore(object):
+  """Content-addressed store of the files gyp generated, per snapshot_key().
+
+  objects/<sha1> holds file contents, shared between snapshots, and
+  snapshots/<key>.json maps the generated paths (relative to root) to
+  their object, together with the hashes of every gyp input file the run
+  loaded. A snapshot is restored only if all of those are unchanged, and
+  only the files whose contents differ are written, so switching back to
+  a variant leaves the make/ninja files that are the same untouched.
+  Generated files of other variants that the snapshot (or a new gyp run)
+  does not have are removed; current.json lists those of the last save or
+  restore."""
+
+  def __init__(self, store_dir, root):
+    self.store_dir = store_dir
+    self.root = root
+    self.objects_dir = os.path.join(store_dir, 'objects')
+    self.snapshots_dir = os.path.join(store_dir, 'snapshots')
+
+  def current_file(self):
+    return os.path.join(self.store_dir, 'current.json')
+
+  def generated_files(self):
+    """Paths (relative to root) gyp may have left from any stored variant."""
+    rtn = set()
+    try:
+      with open(self.current_file()) as f:
+        rtn.update(json.load(f))
+    except (IOError, OSError, ValueError):
+      pass
+    if os.path.isdir(self.snapshots_dir):
+      for fn in os.listdir(self.snapshots_dir):
+        if fn.endswith('.json'):
+          snapshot = self.load(fn[:-len('.json')])
+          if snapshot is not None:
+            rtn.update(snapshot['files'])
+    return rtn
+
+  def remove_stale(self, keep):
+    """Deletes the generated files of other variants not in keep, then
+    records keep as the current ones. Returns the number deleted."""
+    removed = 0
+    for rel in sorted(self.generated_files() - set(keep)):
+      path = os.path.join(self.root, rel)
+      if os.path.isfile(path):
+        os.unlink(path)
+        removed += 1
+    self.replace(self.current_file(),
+                 json.dumps(sorted(keep), indent=2).encode('utf-8'))
+    return removed
+
+  def snapshot_file(self, key):
+    return os.path.join(self.snapshots_dir, key + '.json')
+
+  def object_file(self, digest):
+    return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+  def replace(self, path, data):
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+      f.write(data)
+    os.replace(tmp, path)
+
+  def load(self, key):
+    try:
+      with open(self.snapshot_file(key)) as f:
+        return json.load(f)
+    except (IOError, OSError, ValueError):
+      return None
+
+  def restore(self, key):
+    """Brings the generated files back to the snapshot of key. Returns the
+    snapshot ({'files': ..., 'inputs': ...}) or None if there is none or
+    an input file changed since it was taken."""
+    snapshot = self.load(key)
+    if snapshot is None:
+      return None
+    for path, digest in snapshot['inputs'].items():
+      if file_hash(path) != digest:
+        return None
+    contents = {}
+    for rel, digest in snapshot['files'].items():
+      try:
+        with open(self.object_file(digest), 'rb') as f:
+          contents[rel] = f.read()
+      except (IOError, OSError):
+        return None
+    changed = 0
+    for rel, data in sorted(contents.items()):
+      path = os.path.join(self.root, rel)
+      if file_hash(path) != snapshot['files'][rel]:
+        self.replace(path, data)
+        changed += 1
+    removed = self.remove_stale(contents)
+    os.utime(self.snapshot_file(key), None)  # for the LRU order
+    print('gyp: restored snapshot %s, %d of %d files changed, %d removed' %
+          (key[:12], changed, len(contents), removed))
+    return snapshot
+
+  def save(self, key, paths, inputs):
+    """Records the generated files paths as the snapshot of key; inputs are
+    the gyp files loaded to generate them."""
+    files = {}
+    for path in paths:
+      try:
+        with open(path, 'rb') as f:
+          data = f.read()
+      except (IOError, OSError):
+        continue
+      digest = data_hash(data)
+      if not os.path.exists(self.object_file(digest)):
+        self.replace(self.object_file(digest), data)
+      files[os.path.relpath(path, self.root)] = digest
+    if not files:
+      return
+    snapshot = {
+      'time': time.time(),
+      'files': files,
+      'inputs': dict((path, file_hash(path)) for path in sorted(inputs)),
+    }
+    self.replace(self.snapshot_file(key),
+                 json.dumps(snapshot, indent=2, sort_keys=True).encode('utf-8'))
+    self.remove_stale(files)
+    self.prune()
+
+  def prune(self):
+    """Drops all but the MAX_SNAPSHOTS most recently used snapshots and the
+    objects no snapshot refers to any more."""
+    names = [fn for fn in os.listdir(self.snapshots_dir) if fn.endswith('.json')]
+    names.sort(key=lambda fn: os.path.getmtime(os.path.join(self.snapshots_dir, fn)),
+               reverse=True)
+    for fn in names[MAX_SNAPSHOTS:]:
+      os.unlink(os.path.join(self.snapshots_dir, fn))
+    live = set()
+    for fn in names[:MAX_SNAPSHOTS]:
+      snapshot = self.load(fn[:-len('.json')])
+      if snapshot is not None:
+        live.update(snapshot['files'].values())
+    for sub in os.listdir(self.objects_dir):
+      for rest in os.listdir(os.path.join(self.objects_dir, sub)):
+        if sub + rest not in live:
+          os.unlink(os.path.join(self.objects_dir, sub, rest))
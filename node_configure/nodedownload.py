@@ -3,14 +3,25 @@
 
 from __future__ import print_function
 import hashlib
+import os
 import sys
+import threading
+import time
 import zipfile
 import tarfile
 import contextlib
 try:
-    from urllib.request import FancyURLopener, URLopener
+    from urllib.request import FancyURLopener, URLopener, Request, urlopen
 except ImportError:
     from urllib import FancyURLopener, URLopener
+    from urllib2 import Request, urlopen
+
+# seconds between starting one mirror and the next while none has finished
+RACE_STAGGER = 1.0
+# socket timeout of a mirror download
+RACE_TIMEOUT = 60
+# environment variable holding extra mirrors, separated by whitespace or commas
+MIRRORS_ENV = 'NODE_CONFIGURE_MIRRORS'
 
 def formatSize(amt):
     """Format a size as a string in MB"""
@@ -48,6 +59,122 @@ def retrievefile(url, targetfile):
         print(' ** Error occurred while downloading\n <%s>' % url)
         raise
 
+def mirrors(configured=None):
+    """Mirror URL prefixes from the --download-mirror options and the
+    MIRRORS_ENV environment variable."""
+    found = list(configured or [])
+    found += os.environ.get(MIRRORS_ENV, '').replace(',', ' ').split()
+    return found
+
+def candidateurls(entry, mirror_list=()):
+    """URLs to try for a current_ver.dep entry: its 'url' (a string or a
+    list), its 'mirrors', then the file name under each configured mirror."""
+    urls = entry['url'] if isinstance(entry['url'], list) else [entry['url']]
+    urls = urls + list(entry.get('mirrors', []))
+    name = urls[0].split('/')[-1]
+    urls += [mirror.rstrip('/') + '/' + name for mirror in mirror_list]
+    unique = []
+    for url in urls:
+        if url not in unique:
+            unique.append(url)
+    return unique
+
+class MirrorRace(object):
+    """Downloads the same file from several URLs, starting them RACE_STAGGER
+    seconds apart (or at once when one fails). The first download whose
+    hash matches wins; the others are cancelled."""
+
+    def __init__(self, urls, targetfile, hashAlgo=None, expectHash=None,
+                 stagger=RACE_STAGGER, timeout=RACE_TIMEOUT):
+        self.urls = urls
+        self.targetfile = targetfile
+        self.hashAlgo = hashAlgo
+        self.expectHash = expectHash
+        self.stagger = stagger
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.cancelled = threading.Event()
+        self.winner = None
+        self.finished = 0
+
+    def partfile(self, index):
+        return '%s.part%d' % (self.targetfile, index)
+
+    def fetch(self, index, url):
+        part = self.partfile(index)
+        ok = False
+        start = time.time()
+        try:
+            request = Request(url, headers={'User-Agent': ConfigOpener.version})
+            response = urlopen(request, timeout=self.timeout)
+            digest = hashlib.new(self.hashAlgo) if self.hashAlgo else None
+            size = 0
+            with contextlib.closing(response), open(part, 'wb') as out:
+                while not self.cancelled.is_set():
+                    chunk = response.read(1 << 16)
+                    if not chunk:
+                        break
+                    if digest:
+                        digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            if self.cancelled.is_set():
+                return
+            if digest and digest.hexdigest() != self.expectHash:
+                print(' ** %s: %s mismatch, ignoring this mirror' % (url, self.hashAlgo))
+                return
+            ok = True
+            print(' <%s> %sMB in %.1fs' % (url, formatSize(size), time.time() - start))
+        except Exception as err:
+            if not self.cancelled.is_set():
+                print(' ** %s: %s' % (url, err))
+        finally:
+            with self.cond:
+                self.finished += 1
+                if ok and self.winner is None:
+                    self.winner = (url, part)
+                    self.cancelled.set()
+                elif os.path.exists(part):
+                    os.unlink(part)
+                self.cond.notify_all()
+
+    def run(self):
+        """Returns targetfile, or None if no URL delivered the file."""
+        started = 0
+        with self.cond:
+            for index, url in enumerate(self.urls):
+                if self.winner is not None:
+                    break
+                print(' Fetching <%s>' % url)
+                thread = threading.Thread(target=self.fetch, args=(index, url))
+                thread.daemon = True
+                thread.start()
+                started += 1
+                # give it the stagger before starting the next candidate,
+                # unless one finishes (wins or fails) earlier
+                finished = self.finished
+                deadline = time.time() + self.stagger
+                while self.winner is None and self.finished == finished:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+            while self.winner is None and self.finished < started:
+                self.cond.wait()
+        # the losers notice this between chunks and delete their part files;
+        # one stuck connecting is left to its timeout
+        self.cancelled.set()
+        if self.winner is None:
+            return None
+        url, part = self.winner
+        os.replace(part, self.targetfile)
+        return self.targetfile
+
+def racefile(urls, targetfile, hashAlgo=None, expectHash=None):
+    """Fetch targetfile from the fastest of urls, see MirrorRace. Return
+    targetfile or None."""
+    return MirrorRace(urls, targetfile, hashAlgo, expectHash).run()
+
 def findHash(dict):
     """Find an available hash type."""
     # choose from one of these
@@ -0,0 +1,231 @@
+from __future__ import print_function
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import time
+
+import args_parser
+import util
+
+# configure options that do not change the generated code, so a profile
+# recorded with one value is reused with any other.
+UNRELATED_OPTIONS = ('--prefix', '--tag', '--release-urlbase', '--download',
+                     '--download-path', '--download-mirror', '--download-bundle',
+                     '--jobs', '--link-jobs', '--lto-jobs', '--compiler-cache')
+# --ninja is not one of them: make puts the objects (and so the .gcda files)
+# below out/Release/obj.target, ninja below out/Release/obj.
+UNRELATED_FLAGS = ('--verbose', '--force-gyp',
+                   '--enable-pgo-generate', '--enable-pgo-use')
+
+PROFILE_SUFFIX = '.gcda'
+
+
+def takes_value(name, next_arg):
+    """Whether next_arg is the value of the configure option name, as in
+    '--prefix /x'. Options with an optional value (--enable-lto) only take
+    one that does not look like another option."""
+    if next_arg is None:
+        return False
+    if not hasattr(takes_value, 'actions'):
+        parser = args_parser.creat_parser({'minimum_icu': 0})
+        takes_value.actions = parser._option_string_actions
+    action = takes_value.actions.get(name)
+    if action is None or action.nargs == 0:
+        return False
+    return action.nargs != '?' or not next_arg.startswith('-')
+
+
+def relevant_argv(argv):
+    """argv without the options listed in UNRELATED_OPTIONS (and their
+    values) as [option, value] pairs (value None for flags), sorted so the
+    order options were given in does not matter."""
+    rtn = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        next_arg = argv[i + 1] if i + 1 < len(argv) else None
+        i += 1
+        if '=' in arg:
+            name, value = arg.split('=', 1)
+        elif takes_value(arg, next_arg):
+            name, value = arg, next_arg
+            i += 1
+        else:
+            name, value = arg, None
+        if name in UNRELATED_FLAGS or name in UNRELATED_OPTIONS:
+            continue
+        rtn.append([name, value])
+    return sorted(rtn, key=lambda pair: (pair[0], pair[1] or ''))
+
+
+def git_output(proj_dir, args):
+    try:
+        proc = subprocess.Popen(['git', '-C', proj_dir] + args,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    out = proc.communicate()[0]
+    return out if proc.returncode == 0 else None
+
+
+def source_revision(proj_dir):
+    """HEAD of the checkout, plus a hash of the local changes if any."""
+    head = git_output(proj_dir, ['rev-parse', 'HEAD'])
+    if head is None:
+        util.warn('%s is not a git checkout, profiles are keyed by options only' % proj_dir)
+        return 'unknown'
+    revision = util.to_utf8(head).strip()
+    diff = git_output(proj_dir, ['diff', 'HEAD'])
+    if diff:
+        revision += '+' + hashlib.sha1(diff).hexdigest()[:12]
+    return revision
+
+
+def compiler_id():
+    ok, is_clang, clang_version, gcc_version = util.try_check_compiler(util.CXX, 'c++')
+    version = clang_version if is_clang else gcc_version
+    return '%s %s %s' % (util.CXX, 'clang' if is_clang else 'gcc',
+                         '.'.join(map(str, version or ())))
+
+
+def profile_key(revision, argv, train_cmd):
+    key = json.dumps([revision, relevant_argv(argv), train_cmd])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def load_manifest(profile_dir):
+    try:
+        with open(os.path.join(profile_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def check_profile(profile_dir, revision, argv, compiler, train_cmd):
+    """Returns None if profile_dir holds a usable profile, else the reason."""
+    manifest = load_manifest(profile_dir)
+    if manifest is None:
+        return 'no profile recorded'
+    if manifest.get('revision') != revision:
+        return 'profile is for revision %s' % manifest.get('revision')
+    if manifest.get('options') != relevant_argv(argv):
+        return 'profile was recorded with options %s' % ' '.join(
+            name if value is None else '%s=%s' % (name, value)
+            for name, value in manifest.get('options', []))
+    if manifest.get('train_cmd') != train_cmd:
+        return 'profile was recorded with training command %s' % manifest.get('train_cmd')
+    if manifest.get('compiler') != compiler:
+        return 'profile was recorded with %s' % manifest.get('compiler')
+    if not manifest.get('files'):
+        return 'profile is empty'
+    for fn in manifest['files']:
+        if not os.path.isfile(os.path.join(profile_dir, 'data', fn)):
+            return 'profile file %s is missing' % fn
+    return None
+
+
+def find_profiles(out_dir):
+    rtn = []
+    for path, dirs, files in os.walk(out_dir):
+        for fn in files:
+            if fn.endswith(PROFILE_SUFFIX):
+                rtn.append(os.path.relpath(os.path.join(path, fn), out_dir))
+    return sorted(rtn)
+
+
+def remove_profiles(out_dir):
+    for fn in find_profiles(out_dir):
+        os.unlink(os.path.join(out_dir, fn))
+
+
+def collect_profiles(out_dir, profile_dir, manifest):
+    """Copies the .gcda files of out_dir into profile_dir atomically."""
+    files = find_profiles(out_dir)
+    if not files:
+        util.error('The training run did not produce any %s files in %s' %
+                   (PROFILE_SUFFIX, out_dir))
+    tmp_dir = profile_dir + '.tmp'
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    for fn in files:
+        target = os.path.join(tmp_dir, 'data', fn)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        shutil.copy2(os.path.join(out_dir, fn), target)
+    manifest['files'] = files
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    if os.path.isdir(profile_dir):
+        shutil.rmtree(profile_dir)
+    os.rename(tmp_dir, profile_dir)
+    return files
+
+
+def restore_profiles(profile_dir, out_dir):
+    manifest = load_manifest(profile_dir)
+    remove_profiles(out_dir)
+    for fn in manifest['files']:
+        target = os.path.join(out_dir, fn)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        shutil.copy2(os.path.join(profile_dir, 'data', fn), target)
+
+
+def argv_output_dir(argv):
+    """The output directory configure uses with argv."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--out-dir', dest='out_dir')
+    return util.output_dir(parser.parse_known_args(argv)[0])
+
+
+def run_stage(name, cmd, proj_dir, shell=False):
+    util.info('pgo: %s: %s' % (name, cmd if shell else ' '.join(cmd)))
+    start = time.time()
+    rc = subprocess.call(cmd, cwd=proj_dir, shell=shell)
+    if rc != 0:
+        util.error('pgo: %s failed with exit code %d' % (name, rc))
+    util.info('pgo: %s done in %.1fs' % (name, time.time() - start))
+
+
+def pgo(proj_dir, argv, train_cmd, profile_root=None, configure_cmd='./configure',
+        build_cmd='make', out_dir=None, force=False):
+    """Runs the PGO cycle: an instrumented build and the training command
+    (unless a matching profile is stored), then the optimized build using
+    the profile from profile_root/<key>. The profiles are collected from
+    out_dir, by default the --out-dir given in argv."""
+    proj_dir = os.path.abspath(proj_dir)
+    out_dir = os.path.join(proj_dir, out_dir or argv_output_dir(argv))
+    profile_root = profile_root or os.path.join(proj_dir, '.pgo-profiles')
+    revision = source_revision(proj_dir)
+    compiler = compiler_id()
+    profile_dir = os.path.join(profile_root, profile_key(revision, argv, train_cmd))
+    configure = shlex.split(configure_cmd) + list(argv)
+    build = shlex.split(build_cmd)
+
+    reason = 'regeneration forced' if force else \
+             check_profile(profile_dir, revision, argv, compiler, train_cmd)
+    if reason is None:
+        util.info('pgo: reusing profile %s' % profile_dir)
+    else:
+        util.info('pgo: recording a new profile (%s)' % reason)
+        run_stage('configure (instrumented)', configure + ['--enable-pgo-generate'], proj_dir)
+        run_stage('build (instrumented)', build, proj_dir)
+        remove_profiles(out_dir)
+        run_stage('training', train_cmd, proj_dir, shell=True)
+        files = collect_profiles(out_dir, profile_dir, {
+            'revision': revision,
+            'options': relevant_argv(argv),
+            'compiler': compiler,
+            'train_cmd': train_cmd,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        })
+        util.info('pgo: stored %d profile files in %s' % (len(files), profile_dir))
+
+    restore_profiles(profile_dir, out_dir)
+    run_stage('configure (profile use)', configure + ['--enable-pgo-use'], proj_dir)
+    run_stage('build (optimized)', build, proj_dir)
+    util.info('pgo: optimized build complete')
@@ -0,0 +1,206 @@
+from __future__ import print_function
+import copy
+import hashlib
+import os
+import pickle
+import threading
+
+import util
+from scheduler import contribution
+
+# entries kept per phase, so switching between a few option sets stays cached
+MAX_ENTRIES = 8
+
+# util functions wrapped while phases run: files written and messages shown
+# by a phase are recorded with its entry.
+WRITERS = ('write', 'write_if_changed')
+MESSAGES = ('warn', 'info')
+
+missing = object()
+
+
+class RecordingOptions(object):
+  """Read-only view of the parsed options recording every attribute a phase
+  reads, with the value it saw."""
+
+  def __init__(self, options):
+    self.__dict__['_options'] = options
+    self.__dict__['_reads'] = {}
+
+  def __getattr__(self, name):
+    value = getattr(self._options, name, missing)
+    self._reads[name] = copy.deepcopy(value)
+    if value is missing:
+      raise AttributeError(name)
+    return value
+
+  def __contains__(self, name):
+    return getattr(self, name, missing) is not missing
+
+  def __setattr__(self, name, value):
+    raise AttributeError('configure phases must not modify options (%s)' % name)
+
+
+def source_stamps():
+  """Stamps of the node_configure sources; editing them drops the cache."""
+  here = os.path.dirname(os.path.abspath(__file__))
+  return tuple(util.file_stamp(os.path.join(here, fn))
+               for fn in sorted(os.listdir(here)) if fn.endswith('.py'))
+
+
+def referenced_paths(contrib):
+  """Existing files and directories named by the variables a phase set,
+  e.g. icu_path or node_section_ordering_info."""
+  paths = set()
+  for value in contrib.get('variables', {}).values():
+    if isinstance(value, str) and value and os.path.exists(value):
+      paths.add(os.path.abspath(value))
+  return paths
+
+
+class PhaseCache(object):
+  """On-disk memo of what each configure phase added to the output.
+
+  An entry is keyed by the toolchain fingerprint, the node_configure sources,
+  the target flavor, the environment variables the phase reads, the output
+  of its dependencies and the stamps of its input files and trees, and
+  matches when every option the phase read when it was recorded still
+  has the same value. Files the phase wrote must be unchanged too; on a hit
+  its warnings are shown again and the environment variables it sets are
+  restored."""
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.entries = {}
+    self.hits = []
+    self.misses = []
+    self.changed = False
+    self.lock = threading.Lock()
+    self.local = threading.local()
+    self.saved = {}
+    try:
+      with open(filename, 'rb') as f:
+        self.entries = pickle.load(f)
+    except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+      pass
+    # util.flavor comes from --dest-os, but the phases read it through the
+    # module global, out of sight of RecordingOptions
+    self.base_key = (util.toolchain_fingerprint(os.environ), source_stamps(),
+                     getattr(util, 'flavor', None))
+
+  def key(self, phase, seed):
+    digest = hashlib.sha1(pickle.dumps(
+      (self.base_key, phase.name, [os.environ.get(name) for name in phase.env],
+       sorted(seed.get('variables', {}).items()),
+       sorted((k, v) for k, v in seed.items() if k != 'variables')), 2))
+    return digest.hexdigest()
+
+  def lookup(self, phase, key, options):
+    for entry in self.entries.get(phase.name, []):
+      if (entry['key'] == key and
+          all(copy.deepcopy(getattr(options, name, missing)) == value
+              for name, value in entry['reads'].items()) and
+          all(util.file_stamp(stamp[0]) == stamp for stamp in entry['files']) and
+          all(util.tree_stamp(stamp[0]) == stamp for stamp in entry['trees'])):
+        return entry
+    return None
+
+  def run(self, phase, seed, o, options):
+    """Returns (contribution, result) of phase, from the cache if possible."""
+    key = self.key(phase, seed)
+    with self.lock:
+      entry = self.lookup(phase, key, options) if phase.cache else None
+      if entry is not None and self.entries[phase.name][0] is not entry:
+        # most recently used first: what watch.py follows and the order
+        # entries are dropped in
+        self.entries[phase.name].remove(entry)
+        self.entries[phase.name].insert(0, entry)
+        self.changed = True
+    if entry is not None:
+      for name, value in entry['environ'].items():
+        os.environ[name] = value
+      for func, msg in entry['messages']:
+        getattr(util, func)(msg)
+      with self.lock:
+        self.hits.append(phase.name)
+      return (copy.deepcopy(entry['contrib']), copy.deepcopy(entry['result']))
+
+    recording = RecordingOptions(options)
+    self.local.written = set()
+    self.local.messages = []
+    try:
+      result = phase.func(o, recording)
+    finally:
+      written, self.local.written = self.local.written, None
+      messages, self.local.messages = self.local.messages, None
+    contrib = contribution(seed, o)
+    files = set(os.path.abspath(fn) for fn in phase.files) | written
+    files |= referenced_paths(contrib)
+    entry = {
+      'key': key,
+      'reads': recording._reads,
+      'files': [util.file_stamp(fn) for fn in sorted(files)],
+      'trees': [util.tree_stamp(os.path.abspath(d)) for d in phase.trees],
+      'environ': dict((name, os.environ[name]) for name in phase.environ
+                      if name in os.environ),
+      'messages': messages,
+      'contrib': copy.deepcopy(contrib),
+      'result': copy.deepcopy(result),
+    }
+    with self.lock:
+      self.misses.append(phase.name)
+      if phase.cache:
+        entries = [e for e in self.entries.get(phase.name, [])
+                   if e['key'] != key or e['reads'] != entry['reads']]
+        self.entries[phase.name] = [entry] + entries[:MAX_ENTRIES - 1]
+        self.changed = True
+    return (contrib, result)
+
+  def wrap_writer(self, name):
+    func = self.saved[name]
+    def recording_write(filename, *args, **kwargs):
+      written = getattr(self.local, 'written', None)
+      if written is not None:
+        written.add(os.path.abspath(filename))
+      return func(filename, *args, **kwargs)
+    return recording_write
+
+  def wrap_message(self, name):
+    func = self.saved[name]
+    def recording_message(msg):
+      messages = getattr(self.local, 'messages', None)
+      if messages is not None:
+        messages.append((name, msg))
+      return func(msg)
+    return recording_message
+
+  def install(self):
+    for name in WRITERS + MESSAGES:
+      self.saved[name] = getattr(util, name)
+    for name in WRITERS:
+      setattr(util, name, self.wrap_writer(name))
+    for name in MESSAGES:
+      setattr(util, name, self.wrap_message(name))
+
+  def uninstall(self):
+    # warn() flags itself through the module global, i.e. the wrapper
+    if getattr(util.warn, 'warned', False):
+      self.saved['warn'].warned = True
+    for name, func in self.saved.items():
+      setattr(util, name, func)
+    self.saved = {}
+
+  def save(self):
+    if not self.changed:
+      return
+    dirname = os.path.dirname(self.filename)
+    if dirname and not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    tmp = '%s.%d.tmp' % (self.filename, os.getpid())
+    with open(tmp, 'wb') as f:
+      pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, self.filename)
+
+  def report(self, options):
+    util.print_verbose('configure phases: %d cached, rerun: %s' %
+                       (len(self.hits), ' '.join(self.misses) or 'none'), options)
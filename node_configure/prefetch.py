@@ -0,0 +1,136 @@
+from __future__ import print_function
+import json
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import nodedownload
+import util
+
+# the bundle is a zip of uncompressed archives (they are compressed already)
+# whose central directory is the index; INDEX_NAME describes every member.
+INDEX_NAME = 'bundle.json'
+BUNDLE_VERSION = 1
+# environment variable naming a bundle when --download-bundle is not given
+BUNDLE_ENV = 'NODE_CONFIGURE_BUNDLE'
+
+# icu4c-67_1-src.tgz, icu4c-67_1-src.zip
+icu_archive_re = re.compile(r'icu4c-([0-9]+)[_.]')
+
+
+def bundle_path(configured=None):
+    """The bundle from --download-bundle, else from BUNDLE_ENV, or None."""
+    return configured or os.environ.get(BUNDLE_ENV) or None
+
+
+def archive_name(entry):
+    """File name of a current_ver.dep entry, as used in the download path."""
+    url = entry['url'][0] if isinstance(entry['url'], list) else entry['url']
+    return url.split('/')[-1]
+
+
+def read_index(bundle):
+    """{name: index entry} of bundle, {} if it is missing or not a bundle."""
+    try:
+        with zipfile.ZipFile(bundle) as z:
+            index = json.loads(z.read(INDEX_NAME).decode('utf-8'))
+    except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile):
+        return {}
+    if index.get('version') != BUNDLE_VERSION:
+        return {}
+    return dict((e['name'], e) for e in index['entries'])
+
+
+def extract(bundle, entry, targetfile):
+    """Copies the archive of the current_ver.dep entry out of bundle to
+    targetfile if the bundle has it with the expected hash. Returns
+    targetfile or None."""
+    (expectHash, hashAlgo, _) = nodedownload.findHash(entry)
+    name = archive_name(entry)
+    indexed = read_index(bundle).get(name)
+    if indexed is None or indexed.get(hashAlgo) != expectHash:
+        return None
+    print(' Extracting %s from bundle %s' % (name, bundle))
+    tmp = '%s.%d.tmp' % (targetfile, os.getpid())
+    with zipfile.ZipFile(bundle) as z, z.open(name) as src, open(tmp, 'wb') as out:
+        shutil.copyfileobj(src, out, 1 << 20)
+    os.replace(tmp, targetfile)
+    return targetfile
+
+
+def wanted_entries(dep_file, icu_versions=None):
+    """The current_ver.dep entries to bundle; with icu_versions, those of an
+    ICU older than its minimum_icu are left out."""
+    with open(dep_file) as f:
+        entries = json.load(f)
+    if icu_versions is None:
+        return entries
+    rtn = []
+    for entry in entries:
+        match = icu_archive_re.search(archive_name(entry))
+        if match and int(match.group(1)) < icu_versions['minimum_icu']:
+            print(' Skipping %s, older than ICU %d' %
+                  (archive_name(entry), icu_versions['minimum_icu']))
+            continue
+        rtn.append(entry)
+    return rtn
+
+
+def fetch(entry, download_dir, mirrors, reuse):
+    """Downloads (or takes from reuse, an older bundle) the archive of entry
+    into download_dir and verifies it. Returns the index entry."""
+    (expectHash, hashAlgo, allAlgos) = nodedownload.findHash(entry)
+    name = archive_name(entry)
+    if not expectHash:
+        util.error('No hash to verify %s, expected one of these keys: %s' %
+                   (name, ' '.join(allAlgos)))
+    targetfile = os.path.join(download_dir, name)
+    if not (reuse and extract(reuse, entry, targetfile)):
+        urls = nodedownload.candidateurls(entry, mirrors)
+        if not nodedownload.racefile(urls, targetfile, hashAlgo, expectHash):
+            util.error('Could not download %s' % name)
+    gotHash = nodedownload.checkHash(targetfile, hashAlgo)
+    if gotHash != expectHash:
+        util.error('%s: expected %s %s, got %s' % (name, hashAlgo, expectHash, gotHash))
+    return {
+        'name': name,
+        'url': nodedownload.candidateurls(entry)[0],
+        hashAlgo: expectHash,
+        'size': os.path.getsize(targetfile),
+    }
+
+
+def prefetch(dep_file, output, icu_versions_fn=None, mirrors=(), jobs=None):
+    """Downloads the archives listed in dep_file concurrently, verifies them
+    and packs them into the bundle output, replacing it atomically. Archives
+    already in an existing bundle are not downloaded again."""
+    icu_versions = None
+    if icu_versions_fn:
+        with open(icu_versions_fn) as f:
+            icu_versions = json.load(f)
+    entries = wanted_entries(dep_file, icu_versions)
+    mirrors = nodedownload.mirrors(mirrors)
+    reuse = output if read_index(output) else None
+    download_dir = tempfile.mkdtemp(prefix='node_configure-prefetch-')
+    try:
+        pool = ThreadPoolExecutor(max_workers=jobs or max(len(entries), 1))
+        with pool:
+            index = list(pool.map(lambda e: fetch(e, download_dir, mirrors, reuse), entries))
+        dirname = os.path.dirname(os.path.abspath(output))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = '%s.%d.tmp' % (output, os.getpid())
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED, allowZip64=True) as z:
+            z.writestr(INDEX_NAME, json.dumps({'version': BUNDLE_VERSION,
+                                               'entries': index}, indent=2))
+            for entry in index:
+                z.write(os.path.join(download_dir, entry['name']), entry['name'])
+        os.replace(tmp, output)
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+    print('%s: %d archives, %sMB' % (output, len(index),
+                                     nodedownload.formatSize(os.path.getsize(output))))
+    return output
@@ -0,0 +1,124 @@
+from __future__ import print_function
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Phase(object):
+    """One configure step. func(o, options) fills the output dict o; reads
+    names the o['variables'] keys it needs from earlier phases and writes the
+    keys it sets that later phases read.
+    For phase_cache: files are inputs besides the options, trees directories
+    whose whole contents are, env the variables of os.environ it reads and
+    environ those it sets; cache=False for phases depending on something
+    else, like the free memory."""
+
+    def __init__(self, name, func, reads=(), writes=(), files=(), env=(),
+                 environ=(), cache=True, trees=()):
+        self.name = name
+        self.func = func
+        self.reads = frozenset(reads)
+        self.writes = frozenset(writes)
+        self.files = tuple(files)
+        self.trees = tuple(trees)
+        self.env = tuple(env)
+        self.environ = tuple(environ)
+        self.cache = cache
+
+
+def contribution(seed, o):
+    """What a phase added to o on top of seed: new or changed dict entries,
+    appended list items and changed values, recursively."""
+    rtn = {}
+    for key, value in o.items():
+        if key not in seed:
+            rtn[key] = value
+        elif isinstance(value, dict) and isinstance(seed[key], dict):
+            sub = contribution(seed[key], value)
+            if sub:
+                rtn[key] = sub
+        elif isinstance(value, list) and isinstance(seed[key], list):
+            if value[len(seed[key]):]:
+                rtn[key] = value[len(seed[key]):]
+        elif value != seed[key]:
+            rtn[key] = value
+    return rtn
+
+
+def merge(o, contrib):
+    """Applies a contribution to o: dicts are merged, lists extended."""
+    for key, value in contrib.items():
+        if isinstance(value, dict) and isinstance(o.get(key), dict):
+            merge(o[key], value)
+        elif isinstance(value, list) and isinstance(o.get(key), list):
+            o[key].extend(value)
+        else:
+            o[key] = copy.deepcopy(value)
+
+
+def dependencies(phases):
+    """{name: set of earlier phases writing a variable it reads}, closed
+    transitively."""
+    deps = {}
+    for i, phase in enumerate(phases):
+        deps[phase.name] = set()
+        for earlier in phases[:i]:
+            if earlier.writes & phase.reads:
+                deps[phase.name].add(earlier.name)
+                deps[phase.name] |= deps[earlier.name]
+    return deps
+
+
+def run_phases(phases, new_output, options, cache=None, max_workers=None):
+    """Runs phases concurrently as their dependencies complete. Every phase
+    starts from a fresh output holding what its dependencies wrote, and the
+    contributions are merged in declaration order, so the result is the
+    same as running the phases one after the other. With a PhaseCache,
+    phases whose inputs are unchanged are not run again.
+    Returns (merged output, {name: return value of func})."""
+    deps = dependencies(phases)
+    readers = set()
+    for phase in phases:
+        readers |= phase.reads
+    contributions = {}
+    results = {}
+
+    def run(phase):
+        o = new_output()
+        for earlier in phases:
+            if earlier.name in deps[phase.name]:
+                merge(o, contributions[earlier.name])
+        seed = copy.deepcopy(o)
+        if cache is not None:
+            contrib, result = cache.run(phase, seed, o, options)
+        else:
+            result = phase.func(o, options)
+            contrib = contribution(seed, o)
+        undeclared = (set(contrib.get('variables', {})) & readers) - phase.writes
+        if undeclared:
+            raise Exception('Internal error: configure phase %s sets %s without '
+                            'declaring it' % (phase.name, ', '.join(sorted(undeclared))))
+        return (contrib, result)
+
+    pending = list(phases)
+    running = {}
+    pool = ThreadPoolExecutor(max_workers=max_workers or min(len(phases), (os.cpu_count() or 1) + 4))
+    try:
+        while pending or running:
+            for phase in list(pending):
+                if deps[phase.name] <= set(contributions):
+                    running[pool.submit(run, phase)] = phase
+                    pending.remove(phase)
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                phase = running.pop(future)
+                contributions[phase.name], results[phase.name] = future.result()
+    finally:
+        for future in running:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+    output = new_output()
+    for phase in phases:
+        merge(output, contributions[phase.name])
+    return (output, results)
@@ -0,0 +1,144 @@
+from __future__ import print_function
+import io
+import re
+
+import util
+
+# one frame of `perf script` output: address, symbol+offset, (dso)
+perf_frame_re = re.compile(r'^\s+[0-9a-fA-F]+\s+(\S.*?)(?:\+0x[0-9a-fA-F]+)?\s+\((.*)\)\s*$')
+# one line of a collapsed call graph: frame;frame;...;leaf count
+collapsed_re = re.compile(r'^(\S.*?)\s+([0-9]+)\s*$')
+
+
+def read_perf_script(f, dso=None):
+    """Yields (count, [leaf, caller, ...]) per sample of `perf script`
+    output, which should be produced with --no-demangle."""
+    stack = []
+    for line in f:
+        if not line.strip():
+            if stack:
+                yield (1, stack)
+            stack = []
+            continue
+        match = perf_frame_re.match(line)
+        if not match:
+            continue  # sample header
+        sym, frame_dso = match.groups()
+        if dso and dso not in frame_dso:
+            sym = None
+        stack.append(sym)
+    if stack:
+        yield (1, stack)
+
+
+def read_collapsed(f):
+    """Yields (count, [leaf, caller, ...]) per line of a collapsed call graph
+    (root;...;leaf count), as written by stackcollapse scripts. The frames
+    carry no DSO, so there is nothing to filter --dso on."""
+    for line in f:
+        match = collapsed_re.match(line.strip())
+        if not match:
+            continue
+        frames = match.group(1).split(';')
+        yield (int(match.group(2)), list(reversed(frames)))
+
+
+def detect_format(lines):
+    for line in lines:
+        if perf_frame_re.match(line):
+            return 'perf'
+        if collapsed_re.match(line.strip()) and ';' in line:
+            return 'collapsed'
+    return 'perf'
+
+
+def usable_symbol(sym):
+    # demangled or unresolved names cannot be turned into section names
+    return (sym and sym != '[unknown]' and
+            not any(c in sym for c in ' ()<>:,'))
+
+
+def build_profile(samples):
+    """Returns (hotness, calls): the samples in which each function was the
+    leaf (0 for functions only seen as callers), and {(caller, callee):
+    count} from adjacent frames."""
+    hotness = {}
+    calls = {}
+    for count, stack in samples:
+        for i, sym in enumerate(stack):
+            if not usable_symbol(sym):
+                continue
+            hotness[sym] = hotness.get(sym, 0) + (count if i == 0 else 0)
+            if i + 1 < len(stack) and usable_symbol(stack[i + 1]) and stack[i + 1] != sym:
+                edge = (stack[i + 1], sym)
+                calls[edge] = calls.get(edge, 0) + count
+    return (hotness, calls)
+
+
+def order_functions(hotness, calls, cluster_size=64):
+    """Orders functions with call-chain clustering: walking functions from
+    hottest to coldest, each one's cluster is appended to the cluster of
+    its most frequent caller unless that would exceed cluster_size
+    functions. Clusters are then emitted by decreasing average hotness."""
+    callers = {}
+    for (caller, callee), count in calls.items():
+        best = callers.get(callee)
+        if best is None or (count, caller) > best:
+            callers[callee] = (count, caller)
+
+    cluster_of = dict((sym, [sym]) for sym in hotness)
+    by_hotness = sorted(hotness, key=lambda sym: (-hotness[sym], sym))
+    for sym in by_hotness:
+        if sym not in callers:
+            continue
+        caller = callers[sym][1]
+        if caller not in cluster_of:
+            continue
+        src, dst = cluster_of[sym], cluster_of[caller]
+        if src is dst or len(src) + len(dst) > cluster_size:
+            continue
+        dst.extend(src)
+        for member in src:
+            cluster_of[member] = dst
+
+    clusters = []
+    seen = set()
+    for sym in by_hotness:
+        cluster = cluster_of[sym]
+        if id(cluster) in seen:
+            continue
+        seen.add(id(cluster))
+        clusters.append(cluster)
+    clusters.sort(key=lambda c: -float(sum(hotness[s] for s in c)) / len(c))
+    return [sym for cluster in clusters for sym in cluster]
+
+
+def format_ordering(functions):
+    """gold --section-ordering-file contents for -ffunction-sections code."""
+    return ''.join('.text.%s\n' % sym for sym in functions)
+
+
+def generate(profile, output, fmt='auto', dso=None, cluster_size=64):
+    """Writes a section ordering file for profile to output. Returns the
+    number of functions ordered."""
+    with io.open(profile, encoding='utf-8', errors='replace') as f:
+        lines = f.readlines()
+    if fmt == 'auto':
+        fmt = detect_format(lines)
+    if fmt == 'collapsed':
+        if dso:
+            util.error('--dso needs `perf script` input, collapsed call graphs '
+                       'do not say which DSO a frame is from')
+        samples = read_collapsed(iter(lines))
+    else:
+        samples = read_perf_script(iter(lines), dso)
+    hotness, calls = build_profile(samples)
+    if not hotness:
+        util.error('No usable samples in %s. Record with `perf record -g` and '
+                   'dump with `perf script --no-demangle`.' % profile)
+    functions = order_functions(hotness, calls, cluster_size)
+    with open(output, 'w') as f:
+        f.write(format_ordering(functions))
+    util.info('Wrote %d functions to %s, use it with --use-section-ordering-file=%s' %
+              (len(functions), output, output))
+    return len(functions)
@@ -11,16 +11,70 @@ import io
 import json
 import sys
 import errno
+import tempfile
+import threading
+import time
+import contextlib
+import hashlib
 
 import getmoduleversion
 import getnapibuildversion
 from distutils.spawn import find_executable as which
 from distutils.version import StrictVersion
 import nodedownload
+import prefetch
 
 CC = os.environ.get('CC', 'cc' if sys.platform == 'darwin' else 'gcc')
 CXX = os.environ.get('CXX', 'c++' if sys.platform == 'darwin' else 'g++')
 
+# environment variables that change which toolchain the probes see.
+FINGERPRINT_ENV = ('CC', 'CXX', 'CC_host', 'CXX_host', 'PKG_CONFIG',
+                   'PKG_CONFIG_PATH', 'PATH')
+
+
+def file_stamp(path):
+  """(path, mtime, size) of path, or (path, None, None) if it is missing."""
+  try:
+    st = os.stat(path)
+  except OSError:
+    return (path, None, None)
+  return (path, st.st_mtime, st.st_size)
+
+
+def tree_stamp(path):
+  """(path, newest mtime, number of entries) of the directory tree at path,
+  or (path, None, None) if it is missing."""
+  try:
+    newest = os.stat(path).st_mtime
+  except OSError:
+    return (path, None, None)
+  count = 0
+  for dirpath, dirnames, filenames in os.walk(path):
+    for name in dirnames + filenames:
+      try:
+        newest = max(newest, os.stat(os.path.join(dirpath, name)).st_mtime)
+      except OSError:
+        continue
+      count += 1
+  return (path, newest, count)
+
+
+def toolchain_fingerprint(env):
+  """Identify the toolchain the probes would see under env.
+     Any change of a compiler, assembler, linker, compiler cache or
+     pkg-config binary (or of the variables used to find them) changes
+     the fingerprint."""
+  cc = env.get('CC', CC)
+  cxx = env.get('CXX', CXX)
+  tools = [cc, cxx, env.get('CC_host', cc),
+           env.get('PKG_CONFIG', 'pkg-config'), 'nasm',
+           'ld.gold', 'ld.bfd', 'ld.lld', 'ld.mold', 'ccache', 'sccache']
+  stamps = []
+  for tool in tools:
+    exe = tool.split()[0] if tool.strip() else tool
+    found = which(exe, env.get('PATH')) if not os.path.isabs(exe) else exe
+    stamps.append(file_stamp(os.path.realpath(found)) if found else (exe, None, None))
+  return (tuple(env.get(k) for k in FINGERPRINT_ENV), tuple(stamps))
 
 
 def error(msg):
@@ -215,6 +269,9 @@ def check_compiler(o,options):
     warn('C compiler (CC=%s, %s) too old, need gcc 4.2 or clang 3.2' %
          (CC, version_str))
 
+  if ok and not have_feature('cxx14'):
+    warn('C++ compiler (CXX=%s) cannot compile C++14 with -std=gnu++1y' % CXX)
+
   o['variables']['llvm_version'] = get_llvm_version(CC) if is_clang else '0.0'
 
   # Need xcode_version or gas_version when openssl asm files are compiled.
@@ -228,6 +285,234 @@ def check_compiler(o,options):
     o['variables']['gas_version'] = get_gas_version(CC)
 
 
+def try_compile(cc, flags=[], source='int main(void) { return 0; }\n', lang='c',
+                link=False):
+  """Compiles (and with link=True links) a tiny program with cc (which may
+  include a launcher such as ccache) and flags. Returns True if the
+  compiler exited successfully."""
+  tmp_dir = tempfile.mkdtemp(prefix='node_configure-')
+  try:
+    src = os.path.join(tmp_dir, 'conftest.' + ('cc' if lang == 'c++' else lang))
+    with open(src, 'w') as f:
+      f.write(source)
+    out = os.path.join(tmp_dir, 'conftest' if link else 'conftest.o')
+    try:
+      proc = subprocess.Popen(shlex.split(cc) + flags +
+                              ([] if link else ['-c']) + [src, '-o', out],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+    except OSError:
+      return False
+    proc.communicate()
+    return proc.returncode == 0
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class Check(object):
+  """A feature probe: compiles (or with link=True links) source with flags.
+  cc defaults to CC, or CXX for lang='c++'. lang='S' is preprocessed asm."""
+
+  def __init__(self, name, flags=(), source='int main(void) { return 0; }\n',
+               lang='c', link=False, cc=None):
+    self.name = name
+    self.flags = list(flags)
+    self.source = source
+    self.lang = lang
+    self.link = link
+    self.cc = cc
+
+  def run(self):
+    cc = self.cc or (CXX if self.lang == 'c++' else CC)
+    return try_compile(cc, self.flags, self.source, self.lang, self.link)
+
+  def digest(self):
+    """Identifies the definition of the check, so a cached answer is not
+    reused once its source or flags are edited."""
+    definition = repr((self.flags, self.source, self.lang, self.link, self.cc))
+    return hashlib.sha1(definition.encode('utf-8')).hexdigest()[:12]
+
+
+CHECKS = dict((check.name, check) for check in [
+  Check('cxx14', ['-std=gnu++1y'],
+        'template <typename T> constexpr T pi = T(3.14);\n'
+        'int main() { auto f = [](auto x) { return x; }; return f(0); }\n',
+        lang='c++'),
+  Check('avx2', ['-mavx2'],
+        '#include <immintrin.h>\n'
+        'int main(void) { __m256i a = _mm256_setzero_si256();\n'
+        '  return _mm256_movemask_epi8(_mm256_add_epi32(a, a)); }\n'),
+  Check('avx512f', ['-mavx512f'],
+        '#include <immintrin.h>\n'
+        'int main(void) { __m512i a = _mm512_setzero_si512();\n'
+        '  return _mm512_reduce_add_epi32(_mm512_add_epi32(a, a)); }\n'),
+  Check('aesni', ['-maes', '-msse4.1'],
+        '#include <wmmintrin.h>\n'
+        'int main(void) { __m128i a = _mm_setzero_si128();\n'
+        '  a = _mm_aesenc_si128(a, a); return _mm_cvtsi128_si32(a); }\n'),
+  # AES-NI, PCLMULQDQ and AVX2 instructions as emitted by OpenSSL's x86_64
+  # perlasm, e.g. aesni-gcm-x86_64.pl.
+  Check('x86_64_crypto_asm', [],
+        '.text\n'
+        '.globl conftest_asm\n'
+        'conftest_asm:\n'
+        '  aesenc %xmm1, %xmm0\n'
+        '  vaesenc %xmm1, %xmm2, %xmm3\n'
+        '  vpclmulqdq $0x11, %xmm1, %xmm2, %xmm3\n'
+        '  vpbroadcastq %xmm0, %ymm1\n'
+        '  vpaddq %ymm1, %ymm2, %ymm3\n'
+        '  ret\n',
+        lang='S'),
+  Check('emit_relocs', ['-Wl,--emit-relocs'], link=True),
+])
+
+
+def linker_check(linker, flags=()):
+  """Check linking with -fuse-ld=linker plus flags."""
+  return Check('fuse_ld_%s%s' % (linker, ''.join(
+                 re.sub(r'\W+', '_', flag.replace('-Wl,', '')).rstrip('_')
+                 for flag in flags)),
+               ['-fuse-ld=' + linker] + list(flags), link=True)
+
+
+# autoconf style cache of the feature probes, valid for one toolchain;
+# exec.configure puts it into the output directory.
+feature_cache_file = os.path.join('out', 'config.cache')
+feature_cache = {}
+feature_cache_lock = threading.Lock()
+
+
+def toolchain_key():
+  return hashlib.sha1(repr(toolchain_fingerprint(os.environ)).encode('utf-8')).hexdigest()
+
+
+def load_feature_cache(key):
+  """{name: (check digest, bool)} from feature_cache_file if it was written
+  for key."""
+  results = {}
+  try:
+    with open(feature_cache_file) as f:
+      lines = f.read().splitlines()
+  except (IOError, OSError):
+    return results
+  if not lines or lines[0] != '# toolchain %s' % key:
+    return results
+  for line in lines[1:]:
+    match = re.match(r'^nc_cv_(\w+)=(yes|no)  # check ([0-9a-f]+)$', line)
+    if match:
+      results[match.group(1)] = (match.group(3), match.group(2) == 'yes')
+  return results
+
+
+def save_feature_cache(key, results):
+  dirname = os.path.dirname(feature_cache_file)
+  if dirname and not os.path.isdir(dirname):
+    os.makedirs(dirname)
+  tmp = '%s.%d.tmp' % (feature_cache_file, os.getpid())
+  with open(tmp, 'w') as f:
+    f.write('# toolchain %s\n' % key)
+    f.write('# feature probes of node_configure, delete to probe again\n')
+    for name in sorted(results):
+      digest, answer = results[name]
+      f.write('nc_cv_%s=%s  # check %s\n' % (name, 'yes' if answer else 'no', digest))
+  os.replace(tmp, feature_cache_file)
+
+
+def probe_features(checks):
+  """Answers checks (Check objects or names of CHECKS) as {name: bool}.
+  Results are cached in feature_cache_file for the current toolchain and
+  the definition of each check; the uncached checks are compiled concurrently, each in its own temp dir."""
+  from concurrent.futures import ThreadPoolExecutor
+  checks = [CHECKS[check] if isinstance(check, str) else check for check in checks]
+  key = toolchain_key()
+  with feature_cache_lock:
+    if key not in feature_cache:
+      feature_cache.clear()
+      feature_cache[key] = load_feature_cache(key)
+    results = feature_cache[key]
+    todo = dict((check.name, check) for check in checks
+                if results.get(check.name, (None,))[0] != check.digest())
+  if todo:
+    with ThreadPoolExecutor(max_workers=len(todo)) as pool:
+      answers = dict(zip(todo, pool.map(lambda check: check.run(), todo.values())))
+    with feature_cache_lock:
+      results.update((name, (todo[name].digest(), answer))
+                     for name, answer in answers.items())
+      save_feature_cache(key, results)
+  return dict((check.name, results[check.name][1]) for check in checks)
+
+
+def have_feature(check):
+  """Whether the toolchain passes one check, see probe_features."""
+  name = check if isinstance(check, str) else check.name
+  return probe_features([check])[name]
+
+
+def get_compiler_cache_stats(launcher):
+  """Returns (cache directory, max size) as reported by ccache/sccache."""
+  if launcher == 'sccache':
+    cmds = [(['sccache', '--show-stats'],
+             r'Cache location\s+(?:Local disk: )?"?([^"\n]+)"?',
+             r'Max cache size\s+([^\n]+)')]
+  else:
+    cmds = [(['ccache', '--get-config', 'cache_dir'], r'(.+)', None),
+            (['ccache', '--get-config', 'max_size'], None, r'(.+)'),
+            (['ccache', '-s'], r'cache directory\s+(\S+)', r'max cache size\s+([^\n]+)')]
+  cache_dir = max_size = None
+  for cmd, dir_re, size_re in cmds:
+    try:
+      proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+      continue
+    out = to_utf8(proc.communicate()[0]).strip()
+    if proc.returncode != 0 or not out:
+      continue
+    match = dir_re and re.search(dir_re, out)
+    if match and not cache_dir:
+      cache_dir = match.group(1).strip()
+    match = size_re and re.search(size_re, out)
+    if match and not max_size:
+      max_size = match.group(1).strip()
+  return (cache_dir, max_size)
+
+
+def configure_compiler_cache(o,options):
+  """Picks a compiler launcher for --compiler-cache and checks it works with
+  the probed compiler. The wrapped CC/CXX end up in config.mk and, through
+  configure.export_compiler_cache, in the gyp generated build files."""
+  o['variables']['compiler_cache'] = ''
+  mode = options.compiler_cache or 'none'
+  if mode == 'none' or sys.platform == 'win32':
+    return
+  candidates = ['ccache', 'sccache'] if mode == 'auto' else [mode]
+  for launcher in candidates:
+    if not which(launcher):
+      if mode != 'auto':
+        error('--compiler-cache=%s given but %s is not installed' % (mode, launcher))
+      continue
+    if not (try_compile('%s %s' % (launcher, CC)) and
+            try_compile('%s %s' % (launcher, CXX), lang='c++')):
+      warn('%s does not work with CC=%s CXX=%s, not using it' % (launcher, CC, CXX))
+      continue
+    break
+  else:
+    print_verbose('No usable compiler cache found',options)
+    return
+
+  o['variables']['compiler_cache'] = launcher
+  # Keep the absolute source path out of debug info and __FILE__ so that
+  # the cache can be shared between checkouts.
+  for flag in ['-fdebug-prefix-map=%s=.' % os.getcwd(),
+               '-fmacro-prefix-map=%s=.' % os.getcwd()]:
+    if try_compile(CC, [flag]):
+      o['cflags'] += [flag]
+
+  cache_dir, max_size = get_compiler_cache_stats(launcher)
+  info('Using %s, cache directory: %s, max size: %s' %
+       (launcher, cache_dir or 'unknown', max_size or 'unknown'))
+
+
 def cc_macros(cc=None):
   """Checks predefined macros using the C compiler command."""
   try:
@@ -376,6 +661,58 @@ def gcc_version_ge(version_checked):
 
 
 
+def clang_version_ge(version_checked):
+  for compiler in [(CC, 'c'), (CXX, 'c++')]:
+    ok, is_clang, clang_version, compiler_version = \
+      try_check_compiler(compiler[0], compiler[1])
+    if not is_clang or clang_version < version_checked:
+      return False
+  return True
+
+
+# linker flags passing the ThinLTO cache directory, cache pruning policy and
+# backend job count, for lld and for the LLVM gold plugin.
+THIN_LTO_LINKER_FLAGS = {
+  'lld': ['-Wl,--thinlto-cache-dir=%(dir)s',
+          '-Wl,--thinlto-cache-policy=%(policy)s'],
+  'gold': ['-Wl,-plugin-opt,cache-dir=%(dir)s',
+           '-Wl,-plugin-opt,cache-policy=%(policy)s'],
+}
+THIN_LTO_JOBS_FLAG = {
+  'lld': '-Wl,--thinlto-jobs=%d',
+  'gold': '-Wl,-plugin-opt,jobs=%d',
+}
+
+
+def configure_thin_lto(o,options):
+  version_checked = (5, 0, 0)
+  if not clang_version_ge(version_checked):
+    raise Exception(
+      'The option --enable-lto=thin is supported for clang and clang++ %s'
+      ' or newer only.' % ".".join(map(str, version_checked)))
+
+  checks = [linker_check(linker, ['-flto=thin']) for linker in ('lld', 'gold')]
+  results = probe_features(checks)
+  for linker, check in zip(('lld', 'gold'), checks):
+    if results[check.name]:
+      break
+  else:
+    raise Exception(
+      'The option --enable-lto=thin needs ld.lld or ld.gold with the LLVM '
+      'gold plugin, but linking with -flto=thin failed with both.')
+
+  cache_dir = os.path.abspath(options.thin_lto_cache_dir or
+                              os.path.join(output_dir(options), 'thinlto-cache'))
+  flag_args = {'dir': cache_dir, 'policy': options.thin_lto_cache_policy}
+  o['cflags'] += ['-flto=thin']
+  o.setdefault('ldflags', [])
+  o['ldflags'] += ['-flto=thin', '-fuse-ld=' + linker]
+  o['ldflags'] += [flag % flag_args for flag in THIN_LTO_LINKER_FLAGS[linker]]
+  o['variables']['thin_lto_linker'] = linker
+  print_verbose('ThinLTO with %s, cache in %s (%s)' %
+                (linker, cache_dir, options.thin_lto_cache_policy),options)
+
+
 def configure_node(o,options,flavor,node_version_h):
   if options.dest_os == 'android':
     o['variables']['OS'] = 'android'
@@ -457,7 +794,9 @@ def configure_node(o,options,flavor,node_version_h):
       'The lto option is supported only on linux.')
 
   if flavor == 'linux':
-    if options.enable_lto:
+    if options.enable_lto == 'thin':
+      configure_thin_lto(o,options)
+    elif options.enable_lto:
       version_checked = (5, 4, 1)
       if not gcc_version_ge(version_checked):
         version_checked_str = ".".join(map(str, version_checked))
@@ -465,7 +804,10 @@ def configure_node(o,options,flavor,node_version_h):
           'The option --enable-lto is supported for gcc and gxx %s'
           ' or newer only.' % (version_checked_str))
 
-  o['variables']['enable_lto'] = b(options.enable_lto)
+  # enable_lto selects gcc's full LTO flags in common.gypi, ThinLTO is
+  # configured through the target_defaults written by configure_thin_lto.
+  o['variables']['enable_lto'] = b(options.enable_lto == 'full')
+  o['variables']['enable_thin_lto'] = b(options.enable_lto == 'thin')
 
   if flavor in ('solaris', 'mac', 'linux', 'freebsd'):
     use_dtrace = not options.without_dtrace
@@ -590,22 +932,22 @@ def configure_library(options,lib, output, pkgname=None):
   if getattr(options, shared_lib):
     (pkg_libs, pkg_cflags, pkg_libpath, _) = pkg_config(pkgname or lib)
 
-    if options.__dict__[shared_lib + '_includes']:
-      output['include_dirs'] += [options.__dict__[shared_lib + '_includes']]
+    if getattr(options, shared_lib + '_includes'):
+      output['include_dirs'] += [getattr(options, shared_lib + '_includes')]
     elif pkg_cflags:
       stripped_flags = [flag.strip() for flag in pkg_cflags.split('-I')]
       output['include_dirs'] += [flag for flag in stripped_flags if flag]
 
     # libpath needs to be provided ahead libraries
-    if options.__dict__[shared_lib + '_libpath']:
+    if getattr(options, shared_lib + '_libpath'):
       if flavor == 'win':
         if 'msvs_settings' not in output:
           output['msvs_settings'] = { 'VCLinkerTool': { 'AdditionalOptions': [] } }
         output['msvs_settings']['VCLinkerTool']['AdditionalOptions'] += [
-          '/LIBPATH:%s' % options.__dict__[shared_lib + '_libpath']]
+          '/LIBPATH:%s' % getattr(options, shared_lib + '_libpath')]
       else:
         output['libraries'] += [
-            '-L%s' % options.__dict__[shared_lib + '_libpath']]
+            '-L%s' % getattr(options, shared_lib + '_libpath')]
     elif pkg_libpath:
       output['libraries'] += [pkg_libpath]
 
@@ -682,11 +1024,19 @@ def configure_openssl(o,options):
     is_x86 = 'x64' in variables['target_arch'] or 'ia32' in variables['target_arch']
     
     # blob/OpenSSL_1_1_0-stable/crypto/modes/asm/aesni-gcm-x86_64.pl#L52-L69
-    openssl110_asm_supported = \
-      ('gas_version' in variables and StrictVersion(variables['gas_version']) >= StrictVersion('2.23')) or \
-      ('xcode_version' in variables and StrictVersion(variables['xcode_version']) >= StrictVersion('5.0')) or \
-      ('llvm_version' in variables and StrictVersion(variables['llvm_version']) >= StrictVersion('3.3')) or \
-      ('nasm_version' in variables and StrictVersion(variables['nasm_version']) >= StrictVersion('2.10'))
+    # needs an assembler that knows AVX2; probe it instead of guessing from
+    # the gas/xcode/llvm versions. The probe assembles for the host, so
+    # cross builds and nasm (win) still go by version.
+    cross_compiling = (options.cross_compiling if options.cross_compiling is not None
+                       else bool(options.dest_cpu))
+    if 'nasm_version' in variables or cross_compiling:
+      openssl110_asm_supported = \
+        ('gas_version' in variables and StrictVersion(variables['gas_version']) >= StrictVersion('2.23')) or \
+        ('xcode_version' in variables and StrictVersion(variables['xcode_version']) >= StrictVersion('5.0')) or \
+        ('llvm_version' in variables and StrictVersion(variables['llvm_version']) >= StrictVersion('3.3')) or \
+        ('nasm_version' in variables and StrictVersion(variables['nasm_version']) >= StrictVersion('2.10'))
+    else:
+      openssl110_asm_supported = not is_x86 or have_feature('x86_64_crypto_asm')
 
     if is_x86 and not openssl110_asm_supported:
       error('''Did not find a new enough assembler, install one or build with
@@ -706,6 +1056,252 @@ def configure_openssl(o,options):
   configure_library(options,'openssl', o)
 
 
+# -fuse-ld names and executables of the supported linkers, fastest first.
+LINKERS = [
+  ('mold', ['ld.mold', 'mold']),
+  ('lld', ['ld.lld']),
+  ('gold', ['ld.gold']),
+  ('bfd', ['ld.bfd']),
+]
+
+# optional linker flags, used when a test link with them succeeds.
+LINKER_FLAGS = ['-Wl,--gc-sections', '-Wl,--icf=all']
+
+linker_probes = {}
+
+
+def probe_linker(name, exes):
+  """Returns (version, flags) if CC can link with -fuse-ld=name, where flags
+  are the LINKER_FLAGS that linker accepts, else None. Probed once."""
+  if name in linker_probes:
+    return linker_probes[name]
+  linker_probes[name] = None
+  exe = next((exe for exe in exes if which(exe)), None)
+  if not exe:
+    return None
+  checks = [linker_check(name, [flag]) for flag in LINKER_FLAGS]
+  results = probe_features([linker_check(name)] + checks)
+  if results[linker_check(name).name]:
+    proc = subprocess.Popen([exe, '--version'], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    version = to_utf8(proc.communicate()[0]).split('\n')[0].strip()
+    flags = [flag for flag, check in zip(LINKER_FLAGS, checks)
+             if results[check.name]]
+    linker_probes[name] = (version, flags)
+  return linker_probes[name]
+
+
+def probe_linkers(names):
+  """Probes the linkers in names concurrently. Returns {name: probe}."""
+  from concurrent.futures import ThreadPoolExecutor
+  linkers = [(name, exes) for name, exes in LINKERS if name in names]
+  with ThreadPoolExecutor(max_workers=len(linkers) or 1) as pool:
+    probes = list(pool.map(lambda l: probe_linker(*l), linkers))
+  return dict((name, probe) for (name, _), probe in zip(linkers, probes))
+
+
+def configure_linker(o,options):
+  """Picks the linker for --linker and adds -fuse-ld and the flags it
+  supports to the ldflags."""
+  o['variables']['node_linker'] = ''
+  if sys.platform in ('win32', 'darwin') or not options.linker:
+    return
+  thin_lto_linker = o['variables'].get('thin_lto_linker')
+  if options.linker == 'auto':
+    if thin_lto_linker:
+      names = [thin_lto_linker]
+    elif options.node_section_ordering_info:
+      names = ['gold']  # section ordering needs gold
+    else:
+      names = [name for name, _ in LINKERS]
+  else:
+    if thin_lto_linker and options.linker != thin_lto_linker:
+      error('--linker=%s cannot be used with --enable-lto=thin, which needs %s' %
+            (options.linker, thin_lto_linker))
+    names = [options.linker]
+
+  probes = probe_linkers(names)
+  for name in names:
+    if probes.get(name):
+      break
+  else:
+    if options.linker == 'auto':
+      warn('No usable linker found among %s, using the compiler default' %
+           ', '.join(names))
+      return
+    error('Cannot link with --linker=%s (CC=%s)' % (options.linker, CC))
+
+  version, flags = probes[name]
+  o['variables']['node_linker'] = name
+  o.setdefault('ldflags', [])
+  if ('-fuse-ld=' + name) not in o['ldflags']:
+    o['ldflags'] += ['-fuse-ld=' + name]
+  o['ldflags'] += flags
+  print_verbose('Using linker %s (%s) with %s' %
+                (name, version, ' '.join(flags) or 'no extra flags'),options)
+
+
+def get_tool_version_output(tool):
+  """Returns the output of `tool --version`, or None if tool is not
+  installed or fails."""
+  exe = which(tool)
+  if not exe:
+    return None
+  try:
+    proc = subprocess.Popen([exe, '--version'], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  except OSError:
+    return None
+  out = proc.communicate()
+  if proc.returncode != 0:
+    return None
+  return (to_utf8(out[0]) or to_utf8(out[1])).strip()
+
+
+def get_tool_version(tool):
+  """Returns the first line of `tool --version`, or None if tool is not
+  installed or fails."""
+  out = get_tool_version_output(tool)
+  if out is None:
+    return None
+  return out.split('\n')[0].strip()
+
+
+# "  LLVM version 16.0.6" in the --version output of the LLVM/BOLT tools
+llvm_version_re = re.compile(r'LLVM version ([0-9][^\s]*)')
+
+
+BOLT_OPTIMIZE_FLAGS = ['-reorder-blocks=ext-tsp', '-reorder-functions=hfsort',
+                       '-split-functions', '-split-all-cold', '-split-eh',
+                       '-icf=1', '-use-gnu-stack', '-dyno-stats']
+
+bolt_mk = '''# Post-link optimization of the node binary with BOLT:
+#   make -f bolt.mk bolt BOLT_TRAIN='<command running $$BOLT_NODE>'
+BOLT_NODE_IN ?= %(node)s
+BOLT_NODE_OUT ?= %(node)s.bolt
+BOLT_DIR ?= %(bolt_dir)s
+BOLT_TRAIN ?= %(train)s
+LLVM_BOLT ?= %(llvm_bolt)s
+PERF2BOLT ?= %(perf2bolt)s
+MERGE_FDATA ?= %(merge_fdata)s
+PERF ?= perf
+export BOLT_TRAIN
+
+bolt: $(BOLT_NODE_OUT)
+
+$(BOLT_DIR)/node.fdata: $(BOLT_NODE_IN)
+\tmkdir -p $(BOLT_DIR)
+\trm -f $(BOLT_DIR)/node.fdata*
+%(train_rules)s
+$(BOLT_NODE_OUT): $(BOLT_DIR)/node.fdata
+\t$(LLVM_BOLT) $(BOLT_NODE_IN) -o $@ -data=$(BOLT_DIR)/node.fdata %(flags)s
+
+.PHONY: bolt
+'''
+
+bolt_train_rules = {
+  'instrument': '''\t$(LLVM_BOLT) $(BOLT_NODE_IN) -instrument -instrumentation-file=$(BOLT_DIR)/node.fdata -instrumentation-file-append-pid -o $(BOLT_DIR)/node.instrumented
+\tBOLT_NODE=$(BOLT_DIR)/node.instrumented sh -c "$$BOLT_TRAIN"
+\t$(MERGE_FDATA) $(BOLT_DIR)/node.fdata.* > $(BOLT_DIR)/node.fdata
+''',
+  'perf': '''\tBOLT_NODE=$(BOLT_NODE_IN) $(PERF) record -e cycles:u -j any,u -o $(BOLT_DIR)/perf.data -- sh -c "$$BOLT_TRAIN"
+\t$(PERF2BOLT) $(BOLT_NODE_IN) -p $(BOLT_DIR)/perf.data -o $(BOLT_DIR)/node.fdata
+''',
+}
+
+bolt_ninja = '''# Post-link optimization of the node binary with BOLT:
+#   ninja -f bolt.ninja
+bolt_dir = %(bolt_dir)s
+rule bolt_train
+  command = mkdir -p $bolt_dir && rm -f $bolt_dir/node.fdata* && %(train_cmds)s
+  description = BOLT training run
+rule bolt_optimize
+  command = %(llvm_bolt)s $in -o $out -data=$bolt_dir/node.fdata %(flags)s
+  description = BOLT $out
+build $bolt_dir/node.fdata: bolt_train %(node)s
+build %(node)s.bolt: bolt_optimize %(node)s | $bolt_dir/node.fdata
+build bolt: phony %(node)s.bolt
+default bolt
+'''
+
+
+def configure_bolt(o,options):
+  """Prepares the post-link BOLT stage for --enable-bolt: the node binary is
+  linked with --emit-relocs and bolt.mk (or bolt.ninja) gets a target that
+  trains and optimizes it."""
+  o['variables']['node_use_bolt'] = b(options.enable_bolt)
+  if not options.enable_bolt:
+    return
+  if not sys.platform.startswith('linux'):
+    error('--enable-bolt is only supported on linux')
+  tools = {'llvm_bolt': 'llvm-bolt', 'perf2bolt': 'perf2bolt'}
+  needed = ['llvm_bolt'] + (['perf2bolt'] if options.bolt_mode == 'perf' else [])
+  versions = {}
+  for key in needed:
+    name = tools[key]
+    output = get_tool_version_output(name)
+    if output is None:
+      error('--enable-bolt needs %s, which was not found in PATH' % name)
+    match = llvm_version_re.search(output)
+    versions[name] = match.group(1) if match else None
+    tools[key] = which(name)
+    print_verbose('Found %s: LLVM %s' % (tools[key], versions[name] or 'unknown'),options)
+  if options.bolt_mode == 'perf' and not which('perf'):
+    error('--bolt-mode=perf needs perf, which was not found in PATH')
+  merge_fdata = os.path.join(os.path.dirname(tools['llvm_bolt']), 'merge-fdata')
+  if options.bolt_mode == 'instrument':
+    output = get_tool_version_output(merge_fdata)
+    if output is None:
+      error('--bolt-mode=instrument needs merge-fdata next to %s' % tools['llvm_bolt'])
+    match = llvm_version_re.search(output)
+    versions['merge-fdata'] = match.group(1) if match else None
+  # the profile format changes between LLVM releases, so the tool writing
+  # it and llvm-bolt reading it have to come from the same one
+  known = sorted(set(v for v in versions.values() if v))
+  if len(known) > 1:
+    error('--enable-bolt needs tools from one LLVM release, found %s' %
+          ', '.join('%s %s' % (tool, versions[tool]) for tool in sorted(versions)))
+  if not have_feature('emit_relocs'):
+    error('--enable-bolt needs a linker supporting --emit-relocs')
+
+  o.setdefault('ldflags', [])
+  o['ldflags'] += ['-Wl,--emit-relocs']
+
+  build_type = 'Debug' if options.debug else 'Release'
+  # BOLT_NODE names the binary the training command has to run.
+  train = options.bolt_train_cmd or '$BOLT_NODE benchmark/run.js'
+  bolt_args = {
+    'node': os.path.join(output_dir(options), build_type, 'node'),
+    'bolt_dir': os.path.join(output_dir(options), build_type, 'bolt'),
+    'train': train.replace('$', '$$'),
+    'llvm_bolt': tools['llvm_bolt'],
+    'perf2bolt': tools['perf2bolt'],
+    'merge_fdata': merge_fdata,
+    'train_rules': bolt_train_rules[options.bolt_mode],
+    'flags': ' '.join(BOLT_OPTIMIZE_FLAGS),
+  }
+  if options.use_ninja:
+    train = train.replace("'", "'\\''").replace('$', '$$')
+    if options.bolt_mode == 'perf':
+      bolt_args['train_cmds'] = (
+        "BOLT_NODE=$in perf record -e cycles:u -j any,u -o $bolt_dir/perf.data "
+        "-- sh -c '%s' && %s $in -p $bolt_dir/perf.data -o $out" %
+        (train, tools['perf2bolt']))
+    else:
+      bolt_args['train_cmds'] = (
+        "%s $in -instrument -instrumentation-file=$bolt_dir/node.fdata "
+        "-instrumentation-file-append-pid -o $bolt_dir/node.instrumented && "
+        "BOLT_NODE=$bolt_dir/node.instrumented sh -c '%s' && "
+        "%s $bolt_dir/node.fdata.* > $out" %
+        (tools['llvm_bolt'], train, merge_fdata))
+    write_if_changed(config_path('bolt.ninja', options), do_not_edit + bolt_ninja % bolt_args, options)
+    info('BOLT: after building node, run `ninja -f %s`' % config_path('bolt.ninja', options))
+  else:
+    write_if_changed(config_path('bolt.mk', options), do_not_edit + bolt_mk % bolt_args, options)
+    info('BOLT: after building node, run `make -f %s bolt BOLT_TRAIN=...`' %
+         config_path('bolt.mk', options))
+
+
 def configure_static(o,options):
   if options.fully_static or options.partly_static:
     if flavor == 'mac':
@@ -722,10 +1318,290 @@ def configure_static(o,options):
 
 
 
+def read_first_line(filename):
+  try:
+    with open(filename) as f:
+      return f.readline().strip()
+  except (IOError, OSError):
+    return None
+
+
+def get_cpu_count():
+  """Number of CPUs this process may use, honouring affinity and the
+  cgroup (v2 or v1) CPU quota."""
+  try:
+    cpus = len(os.sched_getaffinity(0))
+  except AttributeError:
+    import multiprocessing
+    cpus = multiprocessing.cpu_count()
+  quota = None
+  cpu_max = read_first_line('/sys/fs/cgroup/cpu.max')
+  if cpu_max and not cpu_max.startswith('max'):
+    quota, period = map(int, cpu_max.split()[:2])
+  else:
+    cfs_quota = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')
+    cfs_period = read_first_line('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if cfs_quota and cfs_period and int(cfs_quota) > 0:
+      quota, period = int(cfs_quota), int(cfs_period)
+  if quota:
+    cpus = min(cpus, max(1, -(-quota // period)))
+  return cpus
+
+
+def get_available_memory():
+  """Bytes of memory available to this process, from /proc/meminfo and the
+  cgroup (v2 or v1) memory limit. None if it cannot be determined."""
+  available = None
+  try:
+    with open('/proc/meminfo') as f:
+      for line in f:
+        if line.startswith('MemAvailable:'):
+          available = int(line.split()[1]) * 1024
+  except (IOError, OSError):
+    pass
+  for limit_fn, usage_fn in [
+      ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+      ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+       '/sys/fs/cgroup/memory/memory.usage_in_bytes')]:
+    limit = read_first_line(limit_fn)
+    if not limit or not limit.isdigit():
+      continue
+    usage = read_first_line(usage_fn)
+    cgroup_available = int(limit) - (int(usage) if usage and usage.isdigit() else 0)
+    if available is None or cgroup_available < available:
+      available = max(0, cgroup_available)
+    break
+  return available
+
+
+# Peak memory of the heaviest compile (V8), link and LTO link steps.
+COMPILE_JOB_MEMORY = 1536 << 20
+LINK_JOB_MEMORY = 4096 << 20
+LTO_LINK_JOB_MEMORY = 8192 << 20
+
+
+def configure_jobs(o,options):
+  """Sizes compile, link and LTO jobs from the CPUs and memory available.
+  Returns {'compile': n, 'link': n, 'lto': n or None} for config.mk; ninja
+  gets the link limit as the depth of gyp's link pool."""
+  cpus = get_cpu_count()
+  memory = get_available_memory()
+  link_memory = LTO_LINK_JOB_MEMORY if options.enable_lto else LINK_JOB_MEMORY
+
+  def fit(per_job):
+    if memory is None:
+      return cpus
+    return max(1, min(cpus, memory // per_job))
+
+  jobs = {
+    'compile': options.jobs or fit(COMPILE_JOB_MEMORY),
+    'link': options.link_jobs or fit(link_memory),
+    'lto': None,
+  }
+  if options.enable_lto == 'thin':
+    # run N ThinLTO backend jobs inside each link.
+    jobs['lto'] = options.lto_jobs or max(1, cpus // jobs['link'])
+    linker = o['variables'].get('thin_lto_linker', 'lld')
+    o.setdefault('ldflags', [])
+    o['ldflags'] += [THIN_LTO_JOBS_FLAG[linker] % jobs['lto']]
+  elif options.enable_lto:
+    # common.gypi passes -flto=4 in its Release configuration, whose ldflags
+    # gyp appends after those of config.gypi, and the last -flto=N wins; an
+    # -flto=N from here would never take effect.
+    if options.lto_jobs:
+      warn('--lto-jobs only applies to --enable-lto=thin, common.gypi '
+           'sets -flto=4 for full LTO')
+
+  os.environ['GYP_LINK_CONCURRENCY'] = str(jobs['link'])
+  print_verbose('%d CPUs, %s MB available: %d compile jobs, %d link jobs%s' %
+                (cpus, memory // (1 << 20) if memory is not None else 'unknown',
+                 jobs['compile'], jobs['link'],
+                 ', %d ThinLTO jobs' % jobs['lto'] if jobs['lto'] else ''),options)
+  return jobs
+
+
+def output_dir(options):
+  """Directory of the gyp output and the configure caches of this variant:
+  --out-dir, or out/ by default."""
+  return options.out_dir or 'out'
+
+
+def config_path(filename, options):
+  """Where a generated config file such as config.gypi goes: into --out-dir
+  if one is given, else into the current directory."""
+  return os.path.join(options.out_dir, filename) if options.out_dir else filename
+
+
+def lock_path(path):
+  """The lock file guarding path: .<name>.lock next to it."""
+  dirname, name = os.path.split(os.path.normpath(path))
+  return os.path.join(dirname, '.%s.lock' % name)
+
+
+@contextlib.contextmanager
+def file_lock(path):
+  """Holds an exclusive lock on path (which need not exist) against other
+  configure processes and threads working in the same tree. Only code
+  changing shared files takes one, so reading configures never wait."""
+  lockfile = lock_path(path)
+  dirname = os.path.dirname(lockfile)
+  if dirname and not os.path.isdir(dirname):
+    try:
+      os.makedirs(dirname)
+    except OSError as e:
+      if e.errno != errno.EEXIST: raise e
+  f = open(lockfile, 'a+')
+  try:
+    if not try_lock(f, True):
+      print('Waiting for another configure to release %s' % path)
+      try_lock(f, False)
+    yield
+  finally:
+    unlock(f)
+    f.close()
+
+
+if sys.platform == 'win32':
+  import msvcrt
+
+  def try_lock(f, nonblocking):
+    f.seek(0)
+    while True:
+      try:
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+      except (IOError, OSError):
+        if nonblocking:
+          return False
+        time.sleep(0.1)
+
+  def unlock(f):
+    f.seek(0)
+    try:
+      msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    except (IOError, OSError):
+      pass
+else:
+  import fcntl
+
+  def try_lock(f, nonblocking):
+    try:
+      fcntl.flock(f.fileno(), fcntl.LOCK_EX | (fcntl.LOCK_NB if nonblocking else 0))
+      return True
+    except (IOError, OSError) as e:
+      if nonblocking and e.errno in (errno.EAGAIN, errno.EACCES):
+        return False
+      raise
+
+  def unlock(f):
+    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def replace_file(filename, data, mode='w'):
+  """Writes data to a temporary file next to filename and renames it over
+  filename, so readers see either the old or the new contents."""
+  tmp = '%s.%d.%d.tmp' % (filename, os.getpid(), threading.current_thread().ident)
+  with open(tmp, mode) as f:
+    f.write(data)
+  os.replace(tmp, filename)
+
+
 def write(filename, data,options):
+  # no lock of its own: the rename keeps concurrent writers from mixing
+  # their contents, and the config files written together do so under the
+  # config lock exec.configure holds
   print_verbose('creating %s' % filename,options)
-  with open(filename, 'w+') as f:
-    f.write(data)
+  dirname = os.path.dirname(filename)
+  if dirname and not os.path.isdir(dirname):
+    try:
+      os.makedirs(dirname)
+    except OSError as e:
+      if e.errno != errno.EEXIST: raise e
+  replace_file(filename, data)
+
+
+try:
+  from _json import encode_basestring_ascii as gypi_str
+except ImportError:
+  from json.encoder import encode_basestring_ascii as gypi_str
+
+
+def gypi_value(value, indent, chunks):
+  """Appends the gyp (python literal) form of value to chunks."""
+  if isinstance(value, str):
+    chunks.append(gypi_str(value))
+  elif isinstance(value, bool) or value is None:
+    chunks.append(repr(value))
+  elif isinstance(value, (int, float)):
+    chunks.append(repr(value))
+  elif isinstance(value, dict):
+    if not value:
+      chunks.append('{}')
+      return
+    pad = '\n' + ' ' * (indent + 2)
+    chunks.append('{')
+    first = True
+    for key in sorted(value):
+      if not first:
+        chunks.append(',')
+      first = False
+      chunks.append(pad)
+      chunks.append(gypi_str(key))
+      chunks.append(': ')
+      gypi_value(value[key], indent + 2, chunks)
+    chunks.append('}')
+  elif isinstance(value, (list, tuple)):
+    if not value:
+      chunks.append('[]')
+    elif all(isinstance(v, str) for v in value):
+      # the common case (icu_src_*, libraries, ...): one string per line
+      pad = ',\n' + ' ' * (indent + 2)
+      chunks.append('[' + pad[1:])
+      chunks.append(pad.join(map(gypi_str, value)))
+      chunks.append(']')
+    else:
+      pad = '\n' + ' ' * (indent + 2)
+      chunks.append('[')
+      for i, v in enumerate(value):
+        if i:
+          chunks.append(',')
+        chunks.append(pad)
+        gypi_value(v, indent + 2, chunks)
+      chunks.append(']')
+  else:
+    raise Exception('Cannot write %r to a gypi file' % (value,))
+
+
+def gypi_dumps(data):
+  """Serializes data as a gyp-compatible python literal with sorted keys.
+     Same output for the same data, unlike dict order dependent writers."""
+  chunks = []
+  gypi_value(data, 0, chunks)
+  return ''.join(chunks)
+
+
+def write_if_changed(filename, data, options):
+  """Like write(), but leaves filename (and its mtime) alone when it already
+  holds data. Returns True if the file was written."""
+  try:
+    with open(filename, 'r') as f:
+      if f.read() == data:
+        print_verbose('%s is up to date' % filename,options)
+        return False
+  except (IOError, OSError):
+    pass
+  write(filename, data, options)
+  return True
+
+
+def write_gypi(filename, data, options):
+  """Writes data as a gypi file plus a .json sidecar next to it, which test
+     runners and build tools can load without evaluating python literals.
+     Unchanged files are not rewritten. Returns True if the gypi changed."""
+  changed = write_if_changed(filename, do_not_edit + gypi_dumps(data) + '\n', options)
+  sidecar = os.path.splitext(filename)[0] + '.json'
+  write_if_changed(sidecar, json.dumps(data, sort_keys=True, indent=2) + '\n', options)
+  return changed
 
 
 def glob_to_var(dir_base, dir_sub, patch_dir):
@@ -751,6 +1627,35 @@ def glob_to_var(dir_base, dir_sub, patch_dir):
 do_not_edit = '# Do not edit. Generated by the configure script.\n'
 
 
+# map from icu_src_<component> variable to the ICU source subdir it lists
+icu_src_dirs = {
+  'stubdata': 'stubdata',
+  'common': 'common',
+  'i18n': 'i18n',
+  'tools': 'tools/toolutil',
+  'genccode': 'tools/genccode',
+  'genrb': 'tools/genrb',
+  'icupkg': 'tools/icupkg',
+}
+
+
+def icu_src_gypi(component):
+  """Name of the gypi holding the icu_src_<component> file list, which goes
+     next to icu_config.gypi."""
+  return 'icu_src_%s.gypi' % component
+
+
+def remove_icu_src_gypis(options):
+  """Deletes the icu_src_*.gypi files (and sidecars) of an earlier bundled
+     ICU configuration, which nothing includes any more."""
+  for component in sorted(icu_src_dirs):
+    gypi = config_path(icu_src_gypi(component), options)
+    for fn in (gypi, os.path.splitext(gypi)[0] + '.json'):
+      if os.path.exists(fn):
+        print_verbose('removing stale %s' % fn,options)
+        os.remove(fn)
+
+
 def configure_intl(o,options,icu_versions,icu_current_ver_dep):
   auto_downloads = nodedownload.parse(options.download_list)
   def icu_download(path):
@@ -762,8 +1667,11 @@ def configure_intl(o,options,icu_versions,icu_current_ver_dep):
       error('''Cannot write to desired download path.
         Either create it or verify permissions.''')
     attemptdownload = nodedownload.candownload(auto_downloads, "icu")
+    mirrors = nodedownload.mirrors(options.download_mirrors)
+    bundle = prefetch.bundle_path(options.download_bundle)
     for icu in icus:
-      url = icu['url']
+      urls = nodedownload.candidateurls(icu, mirrors)
+      url = urls[0]
       (expectHash, hashAlgo, allAlgos) = nodedownload.findHash(icu)
       if not expectHash:
         error('''Could not find a hash to verify ICU download.
@@ -772,11 +1680,13 @@ def configure_intl(o,options,icu_versions,icu_current_ver_dep):
           Expected one of these keys: %s''' % (depFile, url, ' '.join(allAlgos)))
       local = url.split('/')[-1]
       targetfile = os.path.join(options.download_path, local)
-      if not os.path.isfile(targetfile):
-        if attemptdownload:
-          nodedownload.retrievefile(url, targetfile)
-      else:
-        print('Re-using existing %s' % targetfile)
+      with file_lock(targetfile):
+        if not os.path.isfile(targetfile):
+          # a bundle from `node_configure prefetch` needs no network at all
+          if not (bundle and prefetch.extract(bundle, icu, targetfile)) and attemptdownload:
+            nodedownload.racefile(urls, targetfile, hashAlgo, expectHash)
+        else:
+          print('Re-using existing %s' % targetfile)
       if os.path.isfile(targetfile):
         print('Checking file integrity with %s:\r' % hashAlgo)
         gotHash = nodedownload.checkHash(targetfile, hashAlgo)
@@ -790,10 +1700,9 @@ def configure_intl(o,options,icu_versions,icu_current_ver_dep):
   icu_config = {
     'variables': {}
   }
-  icu_config_name = 'icu_config.gypi'
-
-  # write an empty file to start with
-  write(icu_config_name, do_not_edit +pprint.pformat(icu_config, indent=2) + '\n',options)
+  # like config.gypi, into --out-dir if one is given; gyp_node.run_gyp
+  # points the include of icu-generic.gyp there
+  icu_config_name = config_path('icu_config.gypi', options)
 
   # always set icu_small, node.gyp depends on it being defined.
   o['variables']['icu_small'] = b(False)
@@ -808,11 +1717,15 @@ def configure_intl(o,options,icu_versions,icu_current_ver_dep):
     o['variables']['v8_enable_i18n_support'] = 1
     # use the .gyp given
     o['variables']['icu_gyp_path'] = options.with_icu_path
+    write_gypi(icu_config_name, icu_config, options)
+    remove_icu_src_gypis(options)
     return
   # --with-intl=<with_intl>
   # set the default
   if with_intl in (None, 'none'):
     o['variables']['v8_enable_i18n_support'] = 0
+    write_gypi(icu_config_name, icu_config, options)
+    remove_icu_src_gypis(options)
     return  # no Intl
   elif with_intl == 'small-icu':
     # small ICU (English only)
@@ -849,6 +1762,8 @@ def configure_intl(o,options,icu_versions,icu_current_ver_dep):
       o['include_dirs'] += [flag for flag in stripped_flags if flag]
     # use the "system" .gyp
     o['variables']['icu_gyp_path'] = 'tools/icu/icu-system.gyp'
+    write_gypi(icu_config_name, icu_config, options)
+    remove_icu_src_gypis(options)
     return
 
   # this is just the 'deps' dir. Used for unpacking.
@@ -890,52 +1805,64 @@ def configure_intl(o,options,icu_versions,icu_current_ver_dep):
     warn('Ignoring redundant --with-icu-source=%s' % with_icu_source)
     with_icu_source = None
   # if with_icu_source is still set, try to use it.
+  # deps/icu and deps/icu-tmp are shared with other configures in this tree
   if with_icu_source:
-    if os.path.isdir(icu_full_path):
-      print('Deleting old ICU source: %s' % icu_full_path)
-      shutil.rmtree(icu_full_path)
-    # now, what path was given?
-    if os.path.isdir(with_icu_source):
-      # it's a path. Copy it.
-      print('%s -> %s' % (with_icu_source, icu_full_path))
-      shutil.copytree(with_icu_source, icu_full_path)
-    else:
-      # could be file or URL.
-      # Set up temporary area
-      if os.path.isdir(icu_tmp_path):
-        shutil.rmtree(icu_tmp_path)
-      os.mkdir(icu_tmp_path)
-      icu_tarball = None
-      if os.path.isfile(with_icu_source):
-        # it's a file. Try to unpack it.
-        icu_tarball = with_icu_source
-      else:
-        # Can we download it?
-        local = os.path.join(icu_tmp_path, with_icu_source.split('/')[-1])  # local part
-        icu_tarball = nodedownload.retrievefile(with_icu_source, local)
-      # continue with "icu_tarball"
-      nodedownload.unpack(icu_tarball, icu_tmp_path)
-      # Did it unpack correctly? Should contain 'icu'
-      tmp_icu = os.path.join(icu_tmp_path, 'icu')
-      if os.path.isdir(tmp_icu):
-        os.rename(tmp_icu, icu_full_path)
-        shutil.rmtree(icu_tmp_path)
+    with file_lock(icu_full_path):
+      if os.path.isdir(icu_full_path):
+        print('Deleting old ICU source: %s' % icu_full_path)
+        shutil.rmtree(icu_full_path)
+      # now, what path was given?
+      if os.path.isdir(with_icu_source):
+        # it's a path. Copy it.
+        print('%s -> %s' % (with_icu_source, icu_full_path))
+        shutil.copytree(with_icu_source, icu_full_path)
       else:
-        shutil.rmtree(icu_tmp_path)
-        error('--with-icu-source=%s did not result in an "icu" dir.' % \
-               with_icu_source)
+        # could be file or URL.
+        # Set up temporary area
+        if os.path.isdir(icu_tmp_path):
+          shutil.rmtree(icu_tmp_path)
+        os.mkdir(icu_tmp_path)
+        icu_tarball = None
+        if os.path.isfile(with_icu_source):
+          # it's a file. Try to unpack it.
+          icu_tarball = with_icu_source
+        else:
+          # Can we download it?
+          local = os.path.join(icu_tmp_path, with_icu_source.split('/')[-1])  # local part
+          icu_tarball = nodedownload.retrievefile(with_icu_source, local)
+        # continue with "icu_tarball"
+        nodedownload.unpack(icu_tarball, icu_tmp_path)
+        # Did it unpack correctly? Should contain 'icu'
+        tmp_icu = os.path.join(icu_tmp_path, 'icu')
+        if os.path.isdir(tmp_icu):
+          os.rename(tmp_icu, icu_full_path)
+          shutil.rmtree(icu_tmp_path)
+        else:
+          shutil.rmtree(icu_tmp_path)
+          error('--with-icu-source=%s did not result in an "icu" dir.' % \
+                 with_icu_source)
 
   # ICU mode. (icu-generic.gyp)
   o['variables']['icu_gyp_path'] = 'tools/icu/icu-generic.gyp'
   # ICU source dir relative to tools/icu (for .gyp file)
   o['variables']['icu_path'] = icu_full_path
   if not os.path.isdir(icu_full_path):
-    # can we download (or find) a zipfile?
-    localzip = icu_download(icu_full_path)
-    if localzip:
-      nodedownload.unpack(localzip, icu_parent_path)
-    else:
-      warn('* ECMA-402 (Intl) support didn\'t find ICU in %s..' % icu_full_path)
+    with file_lock(icu_full_path):
+      # another configure may have unpacked it while we waited
+      if not os.path.isdir(icu_full_path):
+        # can we download (or find) a zipfile?
+        localzip = icu_download(icu_full_path)
+        if localzip:
+          # unpack aside and move it in place, so nobody sees half of it
+          unpack_path = tempfile.mkdtemp(prefix='icu-unpack-', dir=icu_parent_path)
+          try:
+            nodedownload.unpack(localzip, unpack_path)
+            if os.path.isdir(os.path.join(unpack_path, 'icu')):
+              os.rename(os.path.join(unpack_path, 'icu'), icu_full_path)
+          finally:
+            shutil.rmtree(unpack_path, ignore_errors=True)
+        else:
+          warn('* ECMA-402 (Intl) support didn\'t find ICU in %s..' % icu_full_path)
   if not os.path.isdir(icu_full_path):
     error('''Cannot build Intl without ICU in %s.
        Fix, or disable with "--with-intl=none"''' % icu_full_path)
@@ -971,16 +1898,19 @@ def configure_intl(o,options,icu_versions,icu_current_ver_dep):
   compressed_data = '%s.bz2' % (icu_data_path)
   if not os.path.isfile(icu_data_path) and os.path.isfile(compressed_data):
     # unpack. deps/icu is a temporary path
-    if os.path.isdir(icu_tmp_path):
-      shutil.rmtree(icu_tmp_path)
-    os.mkdir(icu_tmp_path)
-    icu_data_path = os.path.join(icu_tmp_path, icu_data_file_l)
-    with open(icu_data_path, 'wb') as outf:
-        inf = bz2.BZ2File(compressed_data, 'rb')
-        try:
-          shutil.copyfileobj(inf, outf)
-        finally:
-          inf.close()
+    with file_lock(icu_full_path):
+      if not os.path.isdir(icu_tmp_path):
+        os.mkdir(icu_tmp_path)
+      icu_data_path = os.path.join(icu_tmp_path, icu_data_file_l)
+      # configures using the data unpacked before keep a complete file
+      tmp_data_path = '%s.%d.tmp' % (icu_data_path, os.getpid())
+      with open(tmp_data_path, 'wb') as outf:
+          inf = bz2.BZ2File(compressed_data, 'rb')
+          try:
+            shutil.copyfileobj(inf, outf)
+          finally:
+            inf.close()
+      os.replace(tmp_data_path, icu_data_path)
     # Now, proceed..
 
   # relative to dep..
@@ -999,22 +1929,26 @@ def configure_intl(o,options,icu_versions,icu_current_ver_dep):
   # may be little-endian if from a icu-project.org tarball
   o['variables']['icu_data_in'] = icu_data_in
 
-  # map from variable name to subdirs
-  icu_src = {
-    'stubdata': 'stubdata',
-    'common': 'common',
-    'i18n': 'i18n',
-    'tools': 'tools/toolutil',
-    'genccode': 'tools/genccode',
-    'genrb': 'tools/genrb',
-    'icupkg': 'tools/icupkg',
-  }
+  icu_src = icu_src_dirs
   # this creates a variable icu_src_XXX for each of the subdirs
-  # with a list of the src files to use
-  for i in icu_src:
+  # with a list of the src files to use. Each one goes to its own
+  # icu_src_XXX.gypi, rewritten only when the list changes, so a floating
+  # patch in one component leaves the other files (and their mtimes) alone.
+  changed = []
+  for i in sorted(icu_src):
     var  = 'icu_src_%s' % i
     path = '../../%s/source/%s' % (icu_full_path, icu_src[i])
-    icu_config['variables'][var] = glob_to_var('tools/icu', path, 'patches/%s/source/%s' % (icu_ver_major, icu_src[i]) )
+    src_config = { 'variables': {} }
+    src_config['variables'][var] = glob_to_var('tools/icu', path, 'patches/%s/source/%s' % (icu_ver_major, icu_src[i]) )
+    if write_gypi(config_path(icu_src_gypi(i), options), src_config, options):
+      changed.append(icu_src_gypi(i))
+  # icu-generic.gyp only includes icu_config.gypi, which pulls in the lists,
+  # so every ICU target still sees all of them and a change to one list
+  # changes the gyp inputs of all; gyp resolves these relative to
+  # icu_config.gypi, next to them
+  icu_config['includes'] = [icu_src_gypi(i) for i in sorted(icu_src)]
+  if changed:
+    print_verbose('* ICU source lists changed: %s' % ' '.join(changed),options)
   # calculate platform-specific genccode args
   # print("platform %s, flavor %s" % (sys.platform, flavor))
   # if sys.platform == 'darwin':
@@ -1041,8 +1975,7 @@ def configure_intl(o,options,icu_versions,icu_current_ver_dep):
     icu_config['variables']['icu_asm_opts'] = [ '-a', 'gcc' ]
 
   # write updated icu_config.gypi with a bunch of paths
-  write(icu_config_name, do_not_edit +
-        pprint.pformat(icu_config, indent=2) + '\n',options)
+  write_gypi(icu_config_name, icu_config, options)
   return  # end of configure_intl
 
 
@@ -1055,6 +1988,9 @@ def configure_inspector(o,options):
 
 
 def configure_section_file(o,options):
+  linker = o['variables'].get('node_linker')
+  if options.node_section_ordering_info != "" and linker not in (None, '', 'gold'):
+    error('--use-section-ordering-file needs the gold linker, not --linker=%s' % linker)
   try:
     proc = subprocess.Popen(['ld.gold'] + ['-v'], stdin = subprocess.PIPE,
                             stdout = subprocess.PIPE, stderr = subprocess.PIPE)
@@ -1080,7 +2016,7 @@ def configure_section_file(o,options):
     o['variables']['node_section_ordering_info'] = ""
 
 
-def make_bin_override():
+def make_bin_override(out_dir='out'):
   if sys.platform == 'win32':
     raise Exception('make_bin_override should not be called on win32.')
   # If the system python is not the python we are running (which should be
@@ -1093,18 +2029,23 @@ def make_bin_override():
       os.path.realpath(which_python) == os.path.realpath(sys.executable)):
     return
 
-  bin_override = os.path.abspath('out/tools/bin')
+  bin_override = os.path.abspath(os.path.join(out_dir, 'tools', 'bin'))
   try:
     os.makedirs(bin_override)
   except OSError as e:
     if e.errno != errno.EEXIST: raise e
 
   python_link = os.path.join(bin_override, 'python')
-  try:
-    os.unlink(python_link)
-  except OSError as e:
-    if e.errno != errno.ENOENT: raise e
-  os.symlink(sys.executable, python_link)
+  if os.path.realpath(python_link) != os.path.realpath(sys.executable):
+    with file_lock(python_link):
+      # a new link renamed over the old one, never a missing python
+      tmp_link = '%s.%d.tmp' % (python_link, os.getpid())
+      try:
+        os.unlink(tmp_link)
+      except OSError as e:
+        if e.errno != errno.ENOENT: raise e
+      os.symlink(sys.executable, tmp_link)
+      os.replace(tmp_link, python_link)
 
   # We need to set the environment right now so that when gyp (in run_gyp)
   # shells out, it finds the right python (specifically at
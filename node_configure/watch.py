@@ -0,0 +1,225 @@
+from __future__ import print_function
+import argparse
+import ctypes
+import ctypes.util
+import os
+import pickle
+import select
+import struct
+import sys
+import time
+
+import daemon
+import gyp_node
+import util
+import exec as node_exec
+
+# seconds the inputs have to stay unchanged before configure is rerun, so an
+# editor saving several files or a branch switch cause a single rerun
+DEBOUNCE = 0.3
+# seconds between two scans of the inputs when inotify is not available
+POLL_INTERVAL = 1.0
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF | IN_ONLYDIR)
+# struct inotify_event without the name following it
+event_header = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """Watches directories with Linux inotify, called through ctypes."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                use_errno=True)
+        self.libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                                ctypes.c_uint32]
+        # IN_CLOEXEC and IN_NONBLOCK are O_CLOEXEC and O_NONBLOCK
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.dirs = {}  # watch descriptor -> directory
+
+    def watch(self, dirs):
+        watched = set(self.dirs.values())
+        for d in dirs:
+            if d in watched:
+                continue
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), WATCH_MASK)
+            if wd >= 0:
+                self.dirs[wd] = d
+
+    def wait(self, timeout=None):
+        """Paths reported changed within timeout seconds, [] if none."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        paths = []
+        pos = 0
+        while pos + event_header.size <= len(data):
+            wd, mask, cookie, length = event_header.unpack_from(data, pos)
+            name = data[pos + event_header.size:pos + event_header.size + length]
+            pos += event_header.size + length
+            if mask & IN_IGNORED:
+                # the directory is gone; watch() adds it again if it returns
+                self.dirs.pop(wd, None)
+            d = self.dirs.get(wd)
+            if mask & IN_Q_OVERFLOW or d is None:
+                paths.append(None)  # events were lost, anything may have changed
+                continue
+            name = name.rstrip(b'\0')
+            paths.append(os.path.join(d, os.fsdecode(name)) if name else d)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller(object):
+    """Stands in for Inotify where it is not available: every POLL_INTERVAL
+    seconds, anything may have changed."""
+
+    def watch(self, dirs):
+        pass
+
+    def wait(self, timeout=None):
+        time.sleep(POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL))
+        return [None]
+
+    def close(self):
+        pass
+
+
+def create_watcher():
+    if sys.platform.startswith('linux'):
+        try:
+            return Inotify()
+        except (OSError, AttributeError) as e:
+            util.warn('inotify is not available (%s), polling every %.1fs' %
+                      (e, POLL_INTERVAL))
+    return Poller()
+
+
+def output_dir(argv):
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--out-dir', dest='out_dir')
+    return util.output_dir(parser.parse_known_args(argv)[0])
+
+
+def watched_inputs(request, out_dir):
+    """(files, trees) configure and gyp read last time: the inputs of the
+    request, of the phase cache entry every phase used last (the first, see
+    PhaseCache.run) and of the last gyp generation; trees are directories
+    whose whole contents count."""
+    files = set(os.path.abspath(fn) for fn in
+                (request.node_version_h, request.node_napi_h,
+                 request.icu_current_ver_dep, request.icu_versions_fn))
+    trees = set()
+    try:
+        with open(os.path.join(out_dir, node_exec.phase_cache_name), 'rb') as f:
+            entries = pickle.load(f)
+    except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+        entries = {}
+    for phase_entries in entries.values():
+        if phase_entries:
+            files.update(stamp[0] for stamp in phase_entries[0]['files'])
+            trees.update(stamp[0] for stamp in phase_entries[0]['trees'])
+    stamp = gyp_node.load_inputs_stamp(os.path.abspath(out_dir))
+    if stamp:
+        files.update(stamp['files'])
+    return (files, trees)
+
+
+def stamps(files, trees):
+    rtn = dict((fn, util.file_stamp(fn)) for fn in files)
+    rtn.update((d, util.tree_stamp(d)) for d in trees)
+    return rtn
+
+
+def watched_dirs(files, trees):
+    """The directories to watch: those holding the files, and every one in
+    the trees. Missing ones are watched through their closest ancestor."""
+    dirs = set()
+    for path in list(files) + list(trees):
+        d = os.path.dirname(path)
+        while d and not os.path.isdir(d) and os.path.dirname(d) != d:
+            d = os.path.dirname(d)
+        dirs.add(d)
+    for tree in trees:
+        for dirpath, dirnames, filenames in os.walk(tree):
+            dirs.add(dirpath)
+    return dirs
+
+
+def settle(watcher):
+    """Returns once DEBOUNCE seconds passed without further events."""
+    deadline = time.time() + DEBOUNCE
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        if [p for p in watcher.wait(remaining) if p is not None]:
+            deadline = time.time() + DEBOUNCE
+
+
+def watch(proj_dir, argv):
+    """Configures proj_dir with argv, then again whenever a file configure
+    or gyp read changes. The phase cache and the gyp inputs stamp limit each
+    rerun to the phases and generated files depending on what changed;
+    toolchain probes stay warm as in the daemon."""
+    proj_dir = os.path.abspath(proj_dir)
+    request = daemon.default_request(proj_dir, argv)
+    out_dir = os.path.join(proj_dir, output_dir(argv))
+    cache = daemon.WarmCache()
+    cache.install()
+    watcher = create_watcher()
+    req = {'argv': list(argv), 'env': dict(os.environ), 'cwd': proj_dir}
+    try:
+        while True:
+            start = time.time()
+            rc = daemon.run_request(cache, req, sys.stdout)
+            if rc == 0 and os.path.exists(os.path.join(out_dir, '.compile_commands.graph')):
+                import compile_commands
+                os.chdir(proj_dir)
+                compile_commands.update(out_dir)
+            files, trees = watched_inputs(request, out_dir)
+            watcher.watch(watched_dirs(files, trees))
+            last = stamps(files, trees)
+            util.info('watch: configure %s in %.1fs, watching %d files and %d directories' %
+                      ('done' if rc == 0 else 'failed', time.time() - start,
+                       len(files), len(trees)))
+            while True:
+                if not watcher.wait():
+                    continue
+                settle(watcher)
+                current = stamps(files, trees)
+                changed = sorted(p for p in current if current[p] != last[p])
+                if changed:
+                    break
+            names = ', '.join(os.path.relpath(p, proj_dir) for p in changed[:5])
+            if len(changed) > 5:
+                names += ' and %d more' % (len(changed) - 5)
+            util.info('watch: %s changed, reconfiguring' % names)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        watcher.close()
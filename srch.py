@@ -1,59 +1,371 @@
-
+from __future__ import print_function
 import sys
 import os
-import subprocess
-import shlex
-
-def pipe_shell_cmds(shell_CMDs):
-    '''
-        shell_CMDs = {}
-        shell_CMDs[1] = 'netstat -n'
-        shell_CMDs[2] = "awk {'print $6'}"
-    '''
-    len = shell_CMDs.__len__()
-    p = {}
-    p[1] = subprocess.Popen(shlex.split(shell_CMDs[1]), stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    for i in range(2,len):
-        p[i] = subprocess.Popen(shlex.split(shell_CMDs[i]), stdin=p[i-1].stdout, stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    if(len > 1):
-        p[len] = subprocess.Popen(shlex.split(shell_CMDs[len]), stdin=p[len-1].stdout, stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-    result = p[len].communicate()
-    if(len > 1):
-        for i in range(2,len+1):
-            returncode = p[i].wait()
-    else:
-        returncode = p[len].wait()
-    return(result)
-
-def check(fname,dname="./"):
-    fl = []
-    shell_CMDs = {}
-    shell_CMDs[1] = 'tree -f ' + dname
-    shell_CMDs[2] = 'egrep ""'
-    rslt = pipe_shell_cmds(shell_CMDs)[0].decode('utf-8')
-    fl = rslt.replace(chr(9500),"").replace(chr(9472),"").replace(chr(9474),"").replace("\xa0","").replace(chr(9492),"").split("\n")
-    for i in range(0,fl.__len__() -1):
-        ele = fl[i].strip(' ').strip('\t').strip(' ').strip('\t')
-        fl[i] = 'cat ' + ele 
-    fl.pop(fl.__len__() -1)
-    for cmd in fl:
-        shell_CMDs = {}
-        shell_CMDs[1] = cmd
-        shell_CMDs[2] = "egrep " + '"' + fname + '"'
-        rslt = pipe_shell_cmds(shell_CMDs)
-        if(rslt == (b'', b'')):
-            pass
+import re
+import mmap
+import argparse
+import multiprocessing
+
+import srch_index
+
+# never searched, whatever the ignore files say
+ALWAYS_IGNORED = ('.git', '.hg', '.svn')
+# per directory ignore files, in increasing precedence
+IGNORE_FILES = ('.gitignore', '.ignore')
+# a NUL byte in the first BINARY_PROBE bytes marks a file as binary
+BINARY_PROBE = 8192
+# smaller files are read, larger ones mmapped
+MMAP_MIN_SIZE = 1 << 20
+# files handed to a worker at a time
+CHUNK_SIZE = 64
+
+
+def glob_to_re(pat):
+    '''
+        gitignore glob to regex source: * and ? stop at /, ** crosses
+        directories, [...] and [!...] are character classes
+    '''
+    out = ''
+    i = 0
+    while i < len(pat):
+        if pat.startswith('**/', i):
+            out += '(?:.*/)?'
+            i += 3
+            continue
+        if pat.startswith('**', i):
+            out += '.*'
+            i += 2
+            continue
+        c = pat[i]
+        if c == '*':
+            out += '[^/]*'
+        elif c == '?':
+            out += '[^/]'
+        elif c == '[' and pat.find(']', i + 1) != -1:
+            j = pat.find(']', i + 1)
+            cls = pat[i + 1:j]
+            if cls.startswith('!'):
+                cls = '^' + cls[1:]
+            out += '[' + cls.replace('\\', '\\\\') + ']'
+            i = j
+        elif c == '\\' and i + 1 < len(pat):
+            out += re.escape(pat[i + 1])
+            i += 1
         else:
-            print("---location---")
-            print(cmd)
-            print("---rslt----")
-            print(rslt[0].decode('utf-8'))
-            print("----info---")
-            print(rslt[1].decode('utf-8'))
-
-try:
-    check(sys.argv[1],sys.argv[2])
-except:
-    check(sys.argv[1])
-else:
-    pass
+            out += re.escape(c)
+        i += 1
+    return out
+
+
+class IgnoreRules(object):
+    '''
+        the rules of the ignore files of one directory, chained to those of
+        its parent; deeper files and later lines take precedence
+    '''
+
+    def __init__(self, base, parent=None):
+        self.base = base
+        self.parent = parent
+        self.rules = []
+
+    def add(self, line):
+        line = line.rstrip('\n').rstrip('\r')
+        if not line.strip() or line.startswith('#'):
+            return
+        if not line.endswith('\\ '):
+            line = line.rstrip(' ')
+        negate = line.startswith('!')
+        if negate:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        anchored = '/' in line
+        regex = re.compile(glob_to_re(line.lstrip('/')) + '$')
+        self.rules.append((regex, anchored, negate, dir_only))
+
+    def load(self):
+        for fn in IGNORE_FILES:
+            try:
+                with open(os.path.join(self.base, fn), errors='replace') as f:
+                    for line in f:
+                        self.add(line)
+            except (IOError, OSError):
+                pass
+        return self
+
+    def decide(self, path, is_dir):
+        '''True/False if a rule of this chain matches path, else None'''
+        decision = None if self.parent is None else self.parent.decide(path, is_dir)
+        if self.rules:
+            rel = os.path.relpath(path, self.base).replace(os.sep, '/')
+            name = rel.rsplit('/', 1)[-1]
+            for regex, anchored, negate, dir_only in self.rules:
+                if dir_only and not is_dir:
+                    continue
+                if regex.match(rel if anchored else name):
+                    decision = not negate
+        return decision
+
+    def ignored(self, path, is_dir):
+        return bool(self.decide(path, is_dir))
+
+
+def walk(roots, use_ignore=True):
+    '''
+        yields the regular files below roots, depth first, without following
+        symlinked directories
+    '''
+    for root in roots:
+        if not os.path.isdir(root):
+            yield root
+            continue
+        stack = [(root, IgnoreRules(root).load() if use_ignore else None)]
+        while stack:
+            dname, rules = stack.pop()
+            try:
+                entries = sorted(os.scandir(dname), key=lambda e: e.name, reverse=True)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    is_file = not is_dir and entry.is_file()
+                except OSError:
+                    continue
+                if is_dir and entry.name in ALWAYS_IGNORED:
+                    continue
+                if rules is not None and rules.ignored(entry.path, is_dir):
+                    continue
+                if is_dir:
+                    stack.append((entry.path, IgnoreRules(entry.path, rules).load()
+                                  if rules is not None else None))
+                elif is_file:
+                    yield entry.path
+
+
+def compile_patterns(patterns, ignore_case=False):
+    '''
+        one regex matching any of patterns (for scanning) and the
+        individual regexes
+    '''
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    encoded = [p.encode('utf-8') if not isinstance(p, bytes) else p for p in patterns]
+    single = [re.compile(p, flags) for p in encoded]
+    if len(single) == 1:
+        return (single[0], single)
+    return (re.compile(b'|'.join(b'(?:' + p + b')' for p in encoded), flags), single)
+
+
+def search_file(path, regex, single):
+    '''
+        [(lineno, line, [indexes of the patterns matching line])] for the
+        matching lines of path; binary and unreadable files give []
+    '''
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return []
+            if size < MMAP_MIN_SIZE:
+                data = f.read()
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return []
+    found = []
+    try:
+        if data.find(b'\0', 0, BINARY_PROBE) != -1:
+            return []
+        lineno = 1
+        counted = 0
+        pos = 0
+        while True:
+            match = regex.search(data, pos)
+            if match is None:
+                break
+            start = data.rfind(b'\n', 0, match.start()) + 1
+            end = data.find(b'\n', match.start())
+            if end == -1:
+                end = len(data)
+            lineno += data[counted:start].count(b'\n')
+            counted = start
+            line = data[start:end]
+            which = [i for i, p in enumerate(single) if p.search(line)] if len(single) > 1 else [0]
+            found.append((lineno, line, which))
+            pos = end + 1
+            if pos > len(data):
+                break
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+    return found
+
+
+_worker = {}
+
+
+def _init_worker(patterns, ignore_case):
+    _worker['regex'], _worker['single'] = compile_patterns(patterns, ignore_case)
+
+
+def _search_worker(path):
+    return (path, search_file(path, _worker['regex'], _worker['single']))
+
+
+def update_index(root, jobs=None, use_ignore=True, index_file=None):
+    '''
+        loads the trigram index of root and reindexes the files whose mtime
+        or size changed since, returns the index
+    '''
+    index_file = index_file or srch_index.default_index_file(root)
+    index = srch_index.TrigramIndex.load(index_file, root, use_ignore)
+    if index.update(walk([root], use_ignore), root, jobs):
+        index.save(index_file)
+    return index
+
+
+def indexed_paths(patterns, roots, jobs=None, use_ignore=True, index_file=None):
+    '''
+        the files below roots that may match one of patterns according to
+        their trigram indexes
+    '''
+    if srch_index.patterns_query(patterns) == ('all',):
+        # no trigram to look up, e.g. 'x[0-9]+y'
+        for path in walk(roots, use_ignore):
+            yield path
+        return
+    for root in roots:
+        if not os.path.isdir(root):
+            yield root
+            continue
+        index = update_index(root, jobs, use_ignore, index_file)
+        for path in index.candidates(patterns, root):
+            yield path
+
+
+def search(patterns, roots=('./',), jobs=None, use_ignore=True, ignore_case=False,
+           index=False, index_file=None):
+    '''
+        yields (path, lineno, line, pattern indexes) as files are searched;
+        files are walked in this process (or with index=True, narrowed down
+        by the trigram index) and searched by a pool of jobs worker
+        processes, so results come in completion order
+    '''
+    regex, single = compile_patterns(patterns, ignore_case)  # raises re.error early
+    if index:
+        paths = indexed_paths(patterns, roots, jobs, use_ignore, index_file)
+    else:
+        paths = walk(roots, use_ignore)
+    jobs = jobs or multiprocessing.cpu_count()
+    if jobs == 1:
+        results = ((path, search_file(path, regex, single)) for path in paths)
+        for path, found in results:
+            for lineno, line, which in found:
+                yield (path, lineno, line, which)
+        return
+    pool = multiprocessing.Pool(jobs, _init_worker, (patterns, ignore_case))
+    try:
+        for path, found in pool.imap_unordered(_search_worker, paths, CHUNK_SIZE):
+            for lineno, line, which in found:
+                yield (path, lineno, line, which)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def check(fname, dname="./", jobs=None, use_ignore=True, ignore_case=False,
+          index=False, index_file=None):
+    '''
+        prints the lines matching fname (a pattern or a list of patterns)
+        below dname as path:lineno:line, returns the number of lines
+    '''
+    patterns = [fname] if isinstance(fname, (str, bytes)) else list(fname)
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    count = 0
+    results = search(patterns, [dname], jobs, use_ignore, ignore_case, index, index_file)
+    for path, lineno, line, which in results:
+        out.write(('%s:%d:' % (path, lineno)).encode('utf-8') + line + b'\n')
+        count += 1
+    out.flush()
+    return count
+
+
+def creat_parser():
+    parser = argparse.ArgumentParser(prog='srch.py',
+        description='search the files below DIR for lines matching PATTERN')
+    parser.add_argument('-e', '--regexp',
+        action='append',
+        dest='patterns',
+        help='pattern to search for, may be given several times')
+    parser.add_argument('-i', '--ignore-case',
+        action='store_true',
+        dest='ignore_case',
+        default=False,
+        help='match case insensitively')
+    parser.add_argument('-j', '--jobs',
+        action='store',
+        dest='jobs',
+        type=int,
+        help='number of search processes [default: number of CPUs]')
+    parser.add_argument('--no-ignore',
+        action='store_false',
+        dest='use_ignore',
+        default=True,
+        help='also search files excluded by .gitignore and .ignore files')
+    parser.add_argument('--index',
+        action='store_true',
+        dest='index',
+        default=False,
+        help='only search the files the trigram index of DIR allows, updating it first')
+    parser.add_argument('--update-index',
+        action='store_true',
+        dest='update_index',
+        default=False,
+        help='only update the trigram index of DIR, e.g. in the background')
+    parser.add_argument('--index-file',
+        action='store',
+        dest='index_file',
+        help='trigram index to use [default: ~/.cache/srch/<hash of DIR>.idx]')
+    parser.add_argument('args',
+        nargs='*',
+        metavar='PATTERN [DIR]',
+        help='pattern (unless -e is given) and directory to search [default: ./]')
+    return(parser)
+
+
+def main(argv=None):
+    parser = creat_parser()
+    options = parser.parse_args(argv)
+    args = list(options.args)
+    if options.update_index:
+        for root in args or ['./']:
+            index = update_index(root, options.jobs, options.use_ignore, options.index_file)
+            print('%s: %d files, %d trigrams, %d bytes of postings' %
+                  ((root,) + index.stats()))
+        return 0
+    patterns = options.patterns
+    if not patterns:
+        if not args:
+            parser.error('no pattern given')
+        patterns = [args.pop(0)]
+    roots = args or ['./']
+    count = 0
+    try:
+        for dname in roots:
+            count += check(patterns, dname, options.jobs, options.use_ignore,
+                           options.ignore_case, options.index, options.index_file)
+    except re.error as e:
+        parser.error('bad pattern: %s' % e)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # the reader went away, e.g. srch.py ... | head; keep the flush at
+        # exit from failing on the closed pipe again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 141
+    return 0 if count else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
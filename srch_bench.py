@@ -0,0 +1,92 @@
+from __future__ import print_function
+import sys
+import os
+import time
+import argparse
+
+import srch
+import srch_index
+
+DEFAULT_PATTERNS = [
+    'TODO',
+    'def [a-z]+_cache\\(',
+    'include <[a-z]+\\.h>',
+    'copyright',
+    'x[0-9]+y',
+]
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return (time.time() - start, result)
+
+
+def run_search(patterns, root, jobs, index, index_file):
+    return sorted(srch.search(patterns, [root], jobs, True, False, index, index_file))
+
+
+def bench(root, patterns, jobs=None, repeat=3, index_file=None):
+    '''
+        times a cold index build, a no-op update and, per pattern, the
+        linear and the indexed search (best of repeat), checking that both
+        find the same lines
+    '''
+    index_file = index_file or os.path.join(os.path.abspath('.'), '.srch_bench.idx')
+    if os.path.exists(index_file):
+        os.unlink(index_file)
+    build, index = timed(srch.update_index, root, jobs, True, index_file)
+    noop, _ = timed(srch.update_index, root, jobs, True, index_file)
+    live, trigrams, size = index.stats()
+    print('%s: %d files, %d trigrams, %d KiB of postings, %d KiB on disk' %
+          (root, live, trigrams, size >> 10, os.path.getsize(index_file) >> 10))
+    print('build %.2fs, no-op update %.2fs' % (build, noop))
+    print('%-28s %8s %10s %10s %9s %10s' %
+          ('pattern', 'lines', 'linear', 'indexed', 'speedup', 'candidates'))
+    for pattern in patterns:
+        linear = []
+        indexed = []
+        for i in range(repeat):
+            linear.append(timed(run_search, [pattern], root, jobs, False, None))
+            indexed.append(timed(run_search, [pattern], root, jobs, True, index_file))
+        linear_time, linear_lines = min(linear)
+        indexed_time, indexed_lines = min(indexed)
+        if linear_lines != indexed_lines:
+            print('%s: indexed search found %d lines, linear %d' %
+                  (pattern, len(indexed_lines), len(linear_lines)))
+            return 1
+        candidates = len(index.candidates([pattern], root))
+        print('%-28s %8d %9.3fs %9.3fs %8.1fx %10d' %
+              (pattern[:28], len(linear_lines), linear_time, indexed_time,
+               linear_time / max(indexed_time, 1e-6), candidates))
+    os.unlink(index_file)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='srch_bench.py',
+        description='compare linear and trigram indexed srch.py searches')
+    parser.add_argument('root',
+        help='directory to search, e.g. deps/v8')
+    parser.add_argument('-e', '--regexp',
+        action='append',
+        dest='patterns',
+        help='pattern to time, may be given several times [default: a few typical ones]')
+    parser.add_argument('-j', '--jobs',
+        action='store',
+        dest='jobs',
+        type=int,
+        help='number of search processes [default: number of CPUs]')
+    parser.add_argument('--repeat',
+        action='store',
+        dest='repeat',
+        type=int,
+        default=3,
+        help='runs per search, the fastest counts [default: %(default)s]')
+    options = parser.parse_args(argv)
+    return bench(options.root, options.patterns or DEFAULT_PATTERNS,
+                 options.jobs, options.repeat)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
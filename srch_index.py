@@ -0,0 +1,366 @@
+from __future__ import print_function
+import os
+import array
+import bisect
+import hashlib
+import pickle
+import multiprocessing
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+INDEX_VERSION = 1
+# files larger than this are not indexed and always searched
+MAX_INDEXED_SIZE = 16 << 20
+# rebuild instead of appending once this share of the file ids is stale
+MAX_DEAD_RATIO = 0.25
+# literal alternatives tracked per run of a pattern before giving up on it
+MAX_ALTERNATIVES = 16
+
+
+def default_index_file(root):
+    '''
+        ~/.cache/srch/<hash of root>.idx, so the searched trees stay clean
+    '''
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    key = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()
+    return os.path.join(cache, 'srch', key + '.idx')
+
+
+def encode_varints(values, out, last=-1):
+    '''
+        appends the deltas of the ascending values to out as LEB128 varints
+    '''
+    for value in values:
+        delta = value - last
+        last = value
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return last
+
+
+def decode_varints(data):
+    values = []
+    value = -1
+    delta = 0
+    shift = 0
+    for byte in bytearray(data):
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        value += delta
+        values.append(value)
+        delta = 0
+        shift = 0
+    return values
+
+
+def file_trigrams(path):
+    '''
+        sorted array of the trigrams (3 lowercased bytes as one int) in path,
+        None if it is binary, too large or unreadable
+    '''
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > MAX_INDEXED_SIZE:
+                return None
+            data = f.read(8192)
+            if b'\0' in data:
+                return array.array('I')
+            data = (data + f.read()).lower()
+    except (IOError, OSError):
+        return None
+    grams = set(zip(data, data[1:], data[2:]))
+    return array.array('I', sorted((a << 16) | (b << 8) | c for a, b, c in grams))
+
+
+def _trigrams_worker(path):
+    return (path, file_trigrams(path))
+
+
+def string_trigrams(s):
+    return set((s[i] << 16) | (s[i + 1] << 8) | s[i + 2] for i in range(len(s) - 2))
+
+
+def q_and(subs):
+    subs = [q for q in subs if q[0] != 'all']
+    if not subs:
+        return ('all',)
+    return subs[0] if len(subs) == 1 else ('and', subs)
+
+
+def q_or(subs):
+    if not subs or any(q[0] == 'all' for q in subs):
+        return ('all',)
+    return subs[0] if len(subs) == 1 else ('or', subs)
+
+
+def literal_query(strings):
+    '''
+        one of strings occurs: OR over them of AND of their trigrams, or
+        'all' if any is too short to give a trigram
+    '''
+    if any(len(s) < 3 for s in strings):
+        return ('all',)
+    return q_or([q_and([('tri', t) for t in sorted(string_trigrams(s))])
+                 for s in sorted(strings)])
+
+
+def literal_chars(op, av):
+    '''
+        the lowercased bytes a single-character node can match, or None
+    '''
+    name = str(op)
+    if name == 'LITERAL':
+        return set([bytes(bytearray([av])).lower()]) if av < 256 else None
+    if name == 'IN':
+        chars = set()
+        for item_op, item_av in av:
+            if str(item_op) != 'LITERAL' or item_av >= 256:
+                return None
+            chars.add(bytes(bytearray([item_av])).lower())
+        return chars
+    return None
+
+
+def pattern_query(items):
+    '''
+        the trigram query every match of the parsed pattern items satisfies:
+        runs of literal characters give their trigrams, alternatives and
+        repeats are analyzed recursively, everything else breaks the run
+    '''
+    subs = []
+    run = set([b''])
+
+    def flush():
+        if run != set([b'']):
+            subs.append(literal_query(run))
+        run.clear()
+        run.add(b'')
+
+    for op, av in items:
+        name = str(op)
+        chars = literal_chars(op, av)
+        if chars is not None and len(run) * len(chars) <= MAX_ALTERNATIVES:
+            expanded = set(s + c for s in run for c in chars)
+            run.clear()
+            run.update(expanded)
+            continue
+        flush()
+        if name == 'SUBPATTERN':
+            subs.append(pattern_query(av[-1]))
+        elif name == 'BRANCH':
+            subs.append(q_or([pattern_query(branch) for branch in av[1]]))
+        elif name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT') and av[0] >= 1:
+            subs.append(pattern_query(av[2]))
+        elif name == 'ATOMIC_GROUP':
+            subs.append(pattern_query(av))
+    flush()
+    return q_and(subs)
+
+
+def patterns_query(patterns):
+    queries = []
+    for p in patterns:
+        p = p.decode('utf-8', 'surrogateescape') if isinstance(p, bytes) else p
+        try:
+            parsed = sre_parse.parse(p.encode('utf-8'))
+        except Exception:
+            return ('all',)
+        queries.append(pattern_query(list(parsed)))
+    return q_or(queries)
+
+
+class TrigramIndex(object):
+    '''
+        trigram -> ids of the files containing it. the postings are varint
+        delta lists stored back to back in one bytes object, found through
+        sorted arrays of the trigrams, their offsets and their last ids, so
+        loading the index is a few memcpys.
+        files changed since they were indexed get a new, higher id and
+        their old id is only marked dead, so an update appends to the
+        postings; once too many ids are dead the index is rebuilt
+    '''
+
+    def __init__(self, root, use_ignore=True):
+        self.version = INDEX_VERSION
+        self.root = os.path.abspath(root)
+        self.use_ignore = use_ignore
+        self.files = []        # id -> [path below root, mtime, size], None when dead
+        self.dead = 0
+        self.unindexed = set() # ids whose contents are not in the postings
+        self.trigrams = array.array('I')
+        self.offsets = array.array('I', [0])
+        self.lasts = array.array('I')
+        self.data = b''
+
+    @classmethod
+    def load(cls, filename, root, use_ignore=True):
+        try:
+            with open(filename, 'rb') as f:
+                index = pickle.load(f)
+            if (isinstance(index, cls) and index.version == INDEX_VERSION and
+                    index.root == os.path.abspath(root) and index.use_ignore == use_ignore):
+                return index
+        except (IOError, OSError, EOFError, ValueError, AttributeError,
+                pickle.UnpicklingError):
+            pass
+        return cls(root, use_ignore)
+
+    def save(self, filename):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+
+    def posting(self, trigram):
+        i = bisect.bisect_left(self.trigrams, trigram)
+        if i == len(self.trigrams) or self.trigrams[i] != trigram:
+            return b''
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def merge(self, new):
+        '''
+            appends new (trigram -> ascending ids above all indexed ones)
+            to the postings
+        '''
+        trigrams = array.array('I')
+        offsets = array.array('I', [0])
+        lasts = array.array('I')
+        chunks = []
+        size = 0
+        keys = sorted(new)
+        i = j = 0
+        while i < len(self.trigrams) or j < len(keys):
+            if j == len(keys) or (i < len(self.trigrams) and self.trigrams[i] < keys[j]):
+                t = self.trigrams[i]
+                chunk = self.data[self.offsets[i]:self.offsets[i + 1]]
+                last = self.lasts[i]
+                i += 1
+            else:
+                t = keys[j]
+                j += 1
+                chunk = bytearray()
+                last = -1
+                if i < len(self.trigrams) and self.trigrams[i] == t:
+                    chunk += self.data[self.offsets[i]:self.offsets[i + 1]]
+                    last = self.lasts[i]
+                    i += 1
+                last = encode_varints(new[t], chunk, last)
+            trigrams.append(t)
+            lasts.append(last)
+            chunks.append(chunk)
+            size += len(chunk)
+            offsets.append(size)
+        self.trigrams, self.offsets, self.lasts = trigrams, offsets, lasts
+        self.data = b''.join(chunks)
+
+    def update(self, paths, root=None, jobs=None):
+        '''
+            brings the index up to date with paths (below root, by default
+            the indexed directory) by their mtime and size, returns the
+            number of files (re)indexed
+        '''
+        prefix = os.path.join(self.root if root is None else root, '')
+        stamps = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            rel = path[len(prefix):] if path.startswith(prefix) else os.path.relpath(path, self.root)
+            stamps[rel] = (st.st_mtime, st.st_size)
+        indexed = set()
+        for file_id, entry in enumerate(self.files):
+            if entry is None:
+                continue
+            if stamps.get(entry[0]) == (entry[1], entry[2]):
+                indexed.add(entry[0])
+            else:
+                self.files[file_id] = None
+                self.unindexed.discard(file_id)
+                self.dead += 1
+        changed = sorted(path for path in stamps if path not in indexed)
+        if self.dead > MAX_DEAD_RATIO * max(len(self.files), 1):
+            # compact: start over with every current file
+            self.__init__(self.root, self.use_ignore)
+            changed = sorted(stamps)
+        if not changed:
+            return 0
+        full = [os.path.join(self.root, path) for path in changed]
+        jobs = jobs or multiprocessing.cpu_count()
+        pool = None
+        if jobs == 1 or len(changed) < 64:
+            results = map(_trigrams_worker, full)
+        else:
+            pool = multiprocessing.Pool(jobs)
+            results = pool.imap(_trigrams_worker, full, 64)
+        new = {}
+        try:
+            for path, (_, trigrams) in zip(changed, results):
+                file_id = len(self.files)
+                self.files.append([path, stamps[path][0], stamps[path][1]])
+                if trigrams is None:
+                    self.unindexed.add(file_id)
+                    continue
+                for t in trigrams:
+                    ids = new.get(t)
+                    if ids is None:
+                        new[t] = [file_id]
+                    else:
+                        ids.append(file_id)
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        self.merge(new)
+        return len(changed)
+
+    def evaluate(self, query):
+        '''
+            set of the ids satisfying query, None for all of them
+        '''
+        kind = query[0]
+        if kind == 'all':
+            return None
+        if kind == 'tri':
+            return set(decode_varints(self.posting(query[1])))
+        results = [self.evaluate(q) for q in query[1]]
+        if kind == 'and':
+            known = [r for r in results if r is not None]
+            if not known:
+                return None
+            known.sort(key=len)
+            return known[0].intersection(*known[1:])
+        if any(r is None for r in results):
+            return None
+        return set().union(*results)
+
+    def candidates(self, patterns, root=None):
+        '''
+            paths (below root, by default the indexed directory) of the live
+            files that may match one of patterns, sorted
+        '''
+        ids = self.evaluate(patterns_query(patterns))
+        if ids is None:
+            ids = range(len(self.files))
+        else:
+            ids = ids | self.unindexed
+        prefix = os.path.join(self.root if root is None else root, '')
+        return sorted(prefix + self.files[i][0] for i in ids if self.files[i] is not None)
+
+    def stats(self):
+        '''
+            (live files, trigrams, bytes of postings)
+        '''
+        return (len(self.files) - self.dead, len(self.trigrams), len(self.data))